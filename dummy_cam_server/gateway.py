@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import websockets
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from frame_envelope import CONTROL_VERSION, MUX_VERSION, VERSION as ENVELOPE_VERSION, fit_resolution, pack_channel, pack_frame
+
+# Dummy site gateway: one multiplexed connection carrying several cameras.
+# Every camera sends the webcam's frames under its own client_id.
+SERVER_URI = "ws://localhost:8888/ws"
+GATEWAY_ID = "gateway001"
+CAMERA_IDS = ["garud001", "garud002", "garud003", "garud004"]
+RECONNECT_DELAY = 2
+
+# channel number -> camera state; channels are numbered in CAMERA_IDS order
+cameras = {}
+
+def open_request(number):
+    return json.dumps({"type": "open", "channel": number, "client_id": cameras[number]["client_id"],
+                       "envelope": ENVELOPE_VERSION, "control": CONTROL_VERSION,
+                       "max_resolution": cameras[number]["max_resolution"]})
+
+def reset_cameras(native):
+    cameras.clear()
+    for number, client_id in enumerate(CAMERA_IDS):
+        cameras[number] = {"client_id": client_id, "open": False, "credit": 0, "seq": 0, "next_send": 0.0,
+                           "max_resolution": native,
+                           "settings": {"fps": 10, "width": None, "height": None, "quality": 80}}
+
+async def receive_messages(websocket):
+    """Track open channels, credits and each camera's control settings"""
+    async for message in websocket:
+        if not (isinstance(message, str) and message.startswith("{")):
+            continue
+        event = json.loads(message)
+        camera = cameras.get(event.get("channel"))
+        if event.get("type") == "credit":
+            for number, frames in event["credits"].items():
+                cameras[int(number)]["credit"] += frames
+        elif camera is None:
+            print(f"Server message: {event}")
+        elif event["type"] == "opened":
+            camera.update(open=True, credit=event["credit"])
+            print(f"Channel {event['channel']} open for {camera['client_id']}")
+        elif event["type"] == "control":
+            camera["settings"].update({k: event[k] for k in ("fps", "width", "height", "quality") if k in event})
+            print(f"Server settings for {camera['client_id']}: {camera['settings']}")
+        elif event["type"] in ("close", "error"):
+            camera["open"] = False
+            print(f"Channel {event['channel']} closed: {event}")
+            if event["type"] == "close":
+                # The server ended the camera's session; open the channel again for a new one
+                await websocket.send(open_request(event["channel"]))
+
+async def send_frames():
+    async with websockets.connect(SERVER_URI) as websocket:
+        cap = cv2.VideoCapture(0)  # Open default webcam
+        if not cap.isOpened():
+            print("Cannot open camera")
+            return
+        native = [int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))]
+
+        await websocket.send(json.dumps({"client_id": GATEWAY_ID, "mux": MUX_VERSION}))
+        response = json.loads(await websocket.recv())
+        if response.get("mux") != MUX_VERSION:
+            print(f"Server does not multiplex: {response}")
+            return
+        print(f"Server response: {response}")
+
+        reset_cameras(native)
+        receiver = asyncio.create_task(receive_messages(websocket))
+        for number in cameras:
+            await websocket.send(open_request(number))
+
+        try:
+            while not receiver.done():
+                ret, frame = cap.read()
+                captured_at = time.time()
+                if not ret:
+                    print("Failed to grab frame")
+                    break
+
+                # A camera without credit skips this frame; the server has not caught up with it yet
+                for number, camera in cameras.items():
+                    settings = camera["settings"]
+                    if not camera["open"] or camera["credit"] <= 0 or captured_at < camera["next_send"]:
+                        continue
+                    image = frame
+                    size = fit_resolution(frame.shape[1], frame.shape[0], settings)
+                    if size:
+                        image = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                    _, jpeg = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), settings["quality"]])
+                    height, width = image.shape[:2]
+                    await websocket.send(pack_channel(number, pack_frame(camera["seq"], captured_at, width, height,
+                                                                         jpeg.tobytes())))
+                    camera["seq"] += 1
+                    camera["credit"] -= 1
+                    camera["next_send"] = captured_at + 1.0 / settings["fps"]
+
+                await asyncio.sleep(0.01)
+            if receiver.done():
+                receiver.result()  # raises the ConnectionClosed that ended it
+        finally:
+            receiver.cancel()
+            cap.release()
+
+async def run():
+    while True:
+        try:
+            await send_frames()
+            break
+        except (websockets.exceptions.ConnectionClosed, OSError) as e:
+            print(f"Connection lost ({e}), reconnecting in {RECONNECT_DELAY}s")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+asyncio.run(run())
@@ -1,46 +1,104 @@
 import asyncio
+import json
+import os
+import sys
+import time
 import websockets
 import cv2
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from frame_envelope import CONTROL_VERSION, VERSION as ENVELOPE_VERSION, fit_resolution, pack_frame
+
 SERVER_URI = "ws://localhost:8888/ws" 
 # SERVER_URI = "ws://ws.rakiulislam.tech/ws"  # Replace <server_ip> with your actual server IP
 # SERVER_URI = "ws://127.0.0.1:8888/ws" 
 # SERVER_URI = "ws://ip172-18-0-21-d1j0hvc69qi000b7huhg-5000.direct.labs.play-with-docker.com/ws"
 CLIENT_ID = "garud001"
+USE_ENVELOPE = True  # header with sequence number and capture time on every frame
+USE_CONTROL = True  # let the server set frame rate, resolution and quality
+RECONNECT_DELAY = 2  # seconds; a sharded server closes the connection when the camera moves
 
-async def send_frames():
-    async with websockets.connect(SERVER_URI) as websocket:
-        # Send client ID
-        await websocket.send(CLIENT_ID)
-        print(f"Sent client_id: {CLIENT_ID}")
+# Sending settings; the server's control messages replace them
+settings = {"fps": 10, "width": None, "height": None, "quality": 80}
 
-        # Wait for server acknowledgment
-        response = await websocket.recv()
-        print(f"Server response: {response}")
+async def receive_control(websocket):
+    """Apply {"type": "control", ...} messages from the server as they arrive"""
+    async for message in websocket:
+        if isinstance(message, str) and message.startswith("{"):
+            control = json.loads(message)
+            if control.get("type") == "control":
+                settings.update({k: control[k] for k in ("fps", "width", "height", "quality") if k in control})
+                print(f"Server settings: {settings}")
 
+async def send_frames():
+    async with websockets.connect(SERVER_URI) as websocket:
+        # Send client ID, asking for the frame envelope
         cap = cv2.VideoCapture(0)  # Open default webcam
         if not cap.isOpened():
             print("Cannot open camera")
             return
+        native = [int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))]
 
+        if USE_ENVELOPE or USE_CONTROL:
+            await websocket.send(json.dumps({"client_id": CLIENT_ID,
+                                             "envelope": ENVELOPE_VERSION if USE_ENVELOPE else None,
+                                             "control": CONTROL_VERSION if USE_CONTROL else None,
+                                             "max_resolution": native}))
+        else:
+            await websocket.send(CLIENT_ID)
+        print(f"Sent client_id: {CLIENT_ID}")
+
+        # Wait for server acknowledgment; an older server answers with plain text and no options
+        response = await websocket.recv()
+        print(f"Server response: {response}")
+        envelope = control = False
+        if response.startswith("{"):
+            accepted = json.loads(response)
+            envelope = accepted.get("envelope") == ENVELOPE_VERSION
+            control = accepted.get("control") == CONTROL_VERSION
+        control_task = asyncio.create_task(receive_control(websocket)) if control else None
+
+        seq = 0
         try:
             while True:
                 ret, frame = cap.read()
+                captured_at = time.time()
                 if not ret:
                     print("Failed to grab frame")
                     break
 
+                # Scale down to fit the requested resolution, keeping the aspect ratio
+                size = fit_resolution(frame.shape[1], frame.shape[0], settings)
+                if size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
                 # Encode frame as JPEG
-                _, jpeg = cv2.imencode('.jpg', frame)
-                await websocket.send(jpeg.tobytes())
+                _, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), settings["quality"]])
+                if envelope:
+                    height, width = frame.shape[:2]
+                    await websocket.send(pack_frame(seq, captured_at, width, height, jpeg.tobytes()))
+                    seq += 1
+                else:
+                    await websocket.send(jpeg.tobytes())
 
-                # Optional: send ping every few seconds
-                await asyncio.sleep(0.1)
+                # Pace frames at the requested rate
+                await asyncio.sleep(max(0.0, 1.0 / settings["fps"] - (time.time() - captured_at)))
 
         except KeyboardInterrupt:
             print("Client stopped")
         finally:
+            if control_task is not None:
+                control_task.cancel()
             cap.release()
 
-asyncio.run(send_frames())
+async def run():
+    while True:
+        try:
+            await send_frames()
+            break
+        except (websockets.exceptions.ConnectionClosed, OSError) as e:
+            print(f"Connection lost ({e}), reconnecting in {RECONNECT_DELAY}s")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+asyncio.run(run())
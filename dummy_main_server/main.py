@@ -1,9 +1,10 @@
 import asyncio
+import os
+import sys
 import socket
 import websockets
 import cv2
 import numpy as np
-import pickle
 import time
 import threading
 import queue
@@ -11,21 +12,20 @@ import face_recognition
 from flask import Flask, Response, render_template_string
 from threading import Lock
 
+# Share the gallery matcher and ANN index with the main server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from face_gallery import FaceGallery, load_gallery
+
 # Configuration
-ENCODINGS_FILE = "face_encodings.pkl"
 PRINT_COOLDOWN = 15 * 60  # 15 minutes in seconds
 
-# Load face encodings
+# Map face encodings
 try:
-    with open(ENCODINGS_FILE, "rb") as f:
-        data = pickle.load(f)
-        known_face_encodings = np.array(data["encodings"])
-        known_face_names = data["names"]
-    print(f"Loaded {len(known_face_names)} face encodings")
+    gallery = load_gallery()
+    print(f"Loaded {len(gallery)} face encodings")
 except Exception as e:
     print(f"Error loading face encodings: {str(e)}")
-    known_face_encodings = np.array([])
-    known_face_names = []
+    gallery = FaceGallery([], [])
 
 # Global state
 clients = {}
@@ -37,7 +37,7 @@ running = True
 app = Flask(__name__)
 
 def process_frames(input_queue, output_queue, client_id):
-    global running, known_face_encodings, known_face_names
+    global running, gallery
     frame_count = 0
     recognized_names = []
     prev_num_faces = 0
@@ -77,24 +77,11 @@ def process_frames(input_queue, output_queue, client_id):
 
             # Face recognition - limit frequency to reduce CPU usage
             if frame_count % 10 == 0 or force_encode:
-                if len(current_face_locations) > 0 and len(known_face_encodings) > 0:
+                if len(current_face_locations) > 0 and len(gallery) > 0:
                     current_face_encodings = face_recognition.face_encodings(
                         rgb_frame, current_face_locations, model="small"
                     )
-                    current_names = []
-                    for encoding in current_face_encodings:
-                        if encoding.size == 0:
-                            current_names.append("Unknown")
-                            continue
-                        dists = np.linalg.norm(known_face_encodings - encoding, axis=1)
-                        matches = dists <= 0.5
-                        if np.any(matches):
-                            first_match_index = np.argmin(dists)
-                            name = known_face_names[first_match_index]
-                        else:
-                            name = "Unknown"
-                        current_names.append(name)
-                    recognized_names = current_names
+                    recognized_names = gallery.identify(current_face_encodings)
                 else:
                     recognized_names = ["Unknown"] * len(current_face_locations)
 
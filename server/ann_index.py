@@ -0,0 +1,177 @@
+import os
+import numpy as np
+
+INDEX_FILE = "face_index.npz"
+INDEX_VERSION = 2  # 2 adds the gallery generation
+MIN_INDEX_SIZE = 4096  # below this a brute-force scan is already sub-millisecond
+DEFAULT_NPROBE = 8
+KMEANS_ITERS = 10
+TRAIN_POINTS_PER_LIST = 64
+CHUNK_ROWS = 8192
+
+
+def _nearest_centroids(x, centroids, count=1, c_sq=None):
+    """Indices of the `count` nearest centroids for every row of x, computed in chunks"""
+    if c_sq is None:
+        c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty((len(x), count), dtype=np.intp)
+    for start in range(0, len(x), CHUNK_ROWS):
+        chunk = x[start:start + CHUNK_ROWS]
+        # ||x||^2 is constant per row, so it does not change the ranking
+        d = chunk @ centroids.T
+        d *= -2.0
+        d += c_sq[np.newaxis, :]
+        if count < len(centroids):
+            out[start:start + len(chunk)] = np.argpartition(d, count - 1, axis=1)[:, :count]
+        else:
+            out[start:start + len(chunk)] = np.arange(len(centroids))
+    return out
+
+
+def kmeans(x, nlist, iters=KMEANS_ITERS, seed=0):
+    """Lloyd's k-means on a sample of x, returns (nlist, dim) centroids"""
+    rng = np.random.default_rng(seed)
+    max_train = nlist * TRAIN_POINTS_PER_LIST
+    train = x[rng.choice(len(x), max_train, replace=False)] if len(x) > max_train else x
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        labels = _nearest_centroids(train, centroids)[:, 0]
+        order = np.argsort(labels, kind="stable")
+        used, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(train[order], starts, axis=0)
+        counts = np.diff(np.append(starts, len(order)))
+        centroids[used] = sums / counts[:, np.newaxis]
+        # Re-seed empty lists from random training points
+        empty = np.setdiff1d(np.arange(nlist), used)
+        if empty.size:
+            centroids[empty] = train[rng.choice(len(train), empty.size, replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index: encodings bucketed by nearest k-means centroid"""
+
+    def __init__(self, centroids, ids, offsets, nprobe=DEFAULT_NPROBE, generation=None):
+        self.centroids = np.ascontiguousarray(centroids)
+        self.c_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.ids = ids          # gallery row ids grouped by list
+        self.offsets = offsets  # list c holds ids[offsets[c]:offsets[c + 1]]
+        self.nprobe = min(nprobe, len(self.centroids))
+        self.generation = generation  # save_gallery() generation of the gallery it was built for
+
+    @property
+    def ntotal(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, encodings, nlist=None, nprobe=DEFAULT_NPROBE, seed=0, generation=None):
+        encodings = np.asarray(encodings)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(encodings)))
+        nlist = max(1, min(nlist, len(encodings)))
+        centroids = kmeans(encodings, nlist, seed=seed)
+        labels = _nearest_centroids(encodings, centroids)[:, 0]
+        return cls.from_labels(centroids, labels, nprobe, generation)
+
+    @classmethod
+    def from_labels(cls, centroids, labels, nprobe=DEFAULT_NPROBE, generation=None):
+        ids = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, ids, offsets, nprobe, generation)
+
+    def labels(self):
+        """List number of every gallery row"""
+        labels = np.empty(self.ntotal, dtype=np.intp)
+        labels[self.ids] = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        return labels
+
+    def updated(self, keep, new_encodings):
+        """Copy of the index for a gallery that kept rows where `keep` is true and
+        appended `new_encodings`; centroids are reused, so no retraining is needed"""
+        new_labels = _nearest_centroids(np.asarray(new_encodings), self.centroids, 1, self.c_sq)[:, 0]
+        labels = np.concatenate([self.labels()[keep], new_labels])
+        return IVFIndex.from_labels(self.centroids, labels, self.nprobe)
+
+    def save(self, path=INDEX_FILE):
+        np.savez(path, version=INDEX_VERSION, centroids=self.centroids, ids=self.ids,
+                 offsets=self.offsets, nprobe=self.nprobe, generation=self.generation or "")
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path) as f:
+            if int(f["version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version {int(f['version'])}")
+            return cls(f["centroids"], f["ids"], f["offsets"], int(f["nprobe"]), str(f["generation"]) or None)
+
+    def search(self, queries, encodings, sq_norms, k=1):
+        """Probe the nearest lists, then re-rank their members exactly.
+
+        Returns (indices, distances) of shape (num_queries, k); slots with
+        no candidate hold index -1 and distance inf.
+        """
+        q = np.asarray(queries, dtype=encodings.dtype)
+        if q.ndim == 1:
+            q = q[np.newaxis, :]
+        idx = np.full((len(q), k), -1, dtype=np.intp)
+        dist = np.full((len(q), k), np.inf)
+        if len(q) == 0:
+            return idx, dist
+
+        q_sq = np.einsum("ij,ij->i", q, q)
+        probes = _nearest_centroids(q, self.centroids, self.nprobe, self.c_sq)
+        for row, lists in enumerate(probes):
+            cand = np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+            if cand.size == 0:
+                continue
+            d = encodings[cand] @ q[row]
+            d *= -2.0
+            d += sq_norms[cand]
+            d += q_sq[row]
+            np.maximum(d, 0.0, out=d)
+            kk = min(k, cand.size)
+            best = np.argpartition(d, kk - 1)[:kk] if kk < cand.size else np.arange(cand.size)
+            best = best[np.argsort(d[best])]
+            idx[row, :kk] = cand[best]
+            dist[row, :kk] = np.sqrt(d[best])
+        return idx, dist
+
+
+def load_index(path, gallery_size, generation=None):
+    """Load the index at path if it was built for a gallery of gallery_size, else None.
+
+    With a generation (of a saved gallery) the index must also have been
+    built for that generation: a gallery saved after the index, at the same
+    size or not, invalidates it until the index is rebuilt.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        index = IVFIndex.load(path)
+    except Exception as e:
+        print(f"Error loading ANN index: {e}")
+        return None
+    if index.ntotal != gallery_size:
+        print(f"Ignoring stale ANN index ({index.ntotal} entries, gallery has {gallery_size})")
+        return None
+    if generation is not None and index.generation != generation:
+        print(f"Ignoring stale ANN index (built for gallery generation {index.generation}, gallery is {generation})")
+        return None
+    print(f"Loaded ANN index with {len(index.centroids)} lists, nprobe={index.nprobe}")
+    return index
+
+
+def recall_at_k(index, encodings, queries, k=1):
+    """Fraction of the brute-force top-k neighbours that the index also returns"""
+    encodings = np.asarray(encodings)
+    sq_norms = np.einsum("ij,ij->i", encodings, encodings)
+    q = np.asarray(queries, dtype=encodings.dtype)
+    hits = 0
+    for start in range(0, len(q), 32):
+        chunk = q[start:start + 32]
+        d = sq_norms[np.newaxis, :] - 2.0 * (chunk @ encodings.T)
+        exact = np.argpartition(d, k - 1, axis=1)[:, :k] if k < d.shape[1] else d.argsort(axis=1)
+        approx, _ = index.search(chunk, encodings, sq_norms, k)
+        hits += sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+    return hits / (len(q) * min(k, len(encodings)))
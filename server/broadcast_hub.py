@@ -0,0 +1,65 @@
+import collections
+import threading
+
+HUB_FRAMES = 3  # encoded frames kept for viewers that are slightly behind
+
+
+class BroadcastHub:
+    """Encoded frames of one camera, shared by all of its viewers.
+
+    publish() appends a JPEG and its annotations (faces found, for viewers
+    that draw them themselves) to a ring of the last HUB_FRAMES frames and
+    viewers read without consuming, each keeping its own cursor (the seq of
+    the last frame it got). A viewer that falls out of the ring skips to the
+    newest frame, so a slow dashboard drops frames instead of lagging behind
+    or holding up the others. listeners are called (from the publishing
+    thread) after every publish and on close, for readers that cannot block.
+    """
+
+    def __init__(self, size=HUB_FRAMES):
+        self._cond = threading.Condition()
+        self._frames = collections.deque(maxlen=size)  # (seq, jpeg bytes, annotations)
+        self._closed = False
+        self.seq = 0  # seq of the newest frame, 0 before the first
+        self.skipped = 0
+        self.listeners = []
+
+    def publish(self, jpeg, annotations=None):
+        with self._cond:
+            self.seq += 1
+            self._frames.append((self.seq, jpeg, annotations))
+            self._cond.notify_all()
+        self._notify()
+
+    def _notify(self):
+        for listener in list(self.listeners):
+            listener()
+
+    def read(self, cursor=0, timeout=None):
+        """The frame after cursor as (seq, jpeg, annotations), or the newest one if cursor fell out of the ring.
+
+        A new viewer passes cursor 0 and starts at the newest frame. Returns
+        None on timeout or once the hub is closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > cursor or self._closed, timeout)
+            if self._closed or self.seq <= cursor:
+                return None
+            if cursor == 0:
+                return self._frames[-1]
+            oldest = self._frames[0][0]
+            if cursor + 1 >= oldest:
+                return self._frames[cursor + 1 - oldest]
+            self.skipped += self.seq - cursor - 1
+            return self._frames[-1]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._frames.clear()
+            self._cond.notify_all()
+        self._notify()
+
+    @property
+    def closed(self):
+        return self._closed
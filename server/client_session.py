@@ -0,0 +1,69 @@
+import threading
+import time
+from broadcast_hub import BroadcastHub
+from frame_slot import LatestFrameSlot
+
+
+class Session:
+    """Everything one connected camera needs, shared by reference.
+
+    The ingest handler, the processor thread and the video viewers each hold
+    the session itself, so after looking it up once none of them touches the
+    global registry again. stop() is idempotent and wakes everything waiting
+    on the session; joining the processor is left to the caller, outside any
+    shared lock.
+
+    A session can outlive its connection: connection is None and detached_at
+    set while its camera is away, and owner keeps the resolved user/guardian
+    info so a resumed session needs no lookups.
+    """
+    __slots__ = ("client_id", "source", "connection", "frame_slot", "hub", "stop_event",
+                 "stats", "thread", "viewers", "passthrough_viewers", "_viewers_lock", "owner", "detached_at",
+                 "last_active")
+
+    def __init__(self, client_id, source, connection=None):
+        self.client_id = client_id
+        self.source = source
+        self.connection = connection
+        self.frame_slot = LatestFrameSlot()  # holds (jpeg bytes, capture time)
+        self.hub = BroadcastHub()  # annotated frames, JPEG-encoded once for every viewer
+        self.stop_event = threading.Event()
+        # Moving averages in seconds: capture-to-arrival (network) and capture-to-result (latency);
+        # frames lost in transit, arriving out of order, or dropped as late
+        self.stats = {'latency': 0.0, 'network_latency': 0.0, 'lost': 0, 'reordered': 0, 'late': 0,
+                      'resolution': None, 'processed': 0, 'settings': None}
+        self.thread = None
+        self.viewers = 0
+        self.passthrough_viewers = 0  # of viewers, those that draw the boxes themselves
+        self._viewers_lock = threading.Lock()
+        self.owner = None  # resolved by the processor on first start
+        self.detached_at = None
+        self.last_active = time.time()
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    def put_frame(self, data, captured_at):
+        self.last_active = time.time()
+        self.frame_slot.put((data, captured_at))
+
+    def add_viewer(self, passthrough=False):
+        """Count a viewer; a passthrough one takes the camera's own JPEGs and draws from the annotations"""
+        with self._viewers_lock:
+            self.viewers += 1
+            self.passthrough_viewers += passthrough
+
+    def remove_viewer(self, passthrough=False):
+        with self._viewers_lock:
+            self.viewers -= 1
+            self.passthrough_viewers -= passthrough
+
+    def stop(self):
+        self.stop_event.set()
+        self.frame_slot.close()  # drop any pending frame and wake the processor
+        self.hub.close()  # end the viewers' streams
+
+    def join(self, timeout=None):
+        if self.thread is not None and self.thread is not threading.current_thread() and self.thread.is_alive():
+            self.thread.join(timeout)
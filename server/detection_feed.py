@@ -0,0 +1,118 @@
+import collections
+import json
+import threading
+
+SUBSCRIBER_BUFFER = 100  # events kept for a subscriber that is behind; older ones are dropped
+
+
+class Subscription:
+    """One subscriber's filtered view of the detection feed.
+
+    client_ids and names are sets, or None for no filter. With a names filter
+    only events showing one of those identities are delivered, and only with
+    the matching faces. Events queue up to SUBSCRIBER_BUFFER, dropping the
+    oldest. listeners are called (from the publishing thread) after each
+    delivered event and on close, for readers that cannot block.
+    """
+
+    def __init__(self, client_ids=None, names=None, size=SUBSCRIBER_BUFFER):
+        self.client_ids = client_ids
+        self.names = names
+        self.dropped = 0
+        self.listeners = []
+        self._cond = threading.Condition()
+        self._events = collections.deque(maxlen=size)
+        self._closed = False
+
+    def filter(self, event):
+        """event as this subscriber should see it, or None"""
+        if self.client_ids is not None and event["client_id"] not in self.client_ids:
+            return None
+        if self.names is not None:
+            faces = [face for face in event["faces"] if face["name"] in self.names]
+            if not faces:
+                return None
+            event = {**event, "faces": faces}
+        return event
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._cond.notify()
+        self._notify()
+
+    def get(self, timeout=None):
+        """Next event, or None on timeout or once closed"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events or self._closed, timeout)
+            if self._closed or not self._events:
+                return None
+            return self._events.popleft()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._notify()
+
+    def _notify(self):
+        for listener in list(self.listeners):
+            listener()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class DetectionFeed:
+    """Per-frame detection events from every processor, fanned out to subscribers.
+
+    An event is {"client_id", "seq", "captured_at", "processed_at", "faces":
+    [{"box": [top, right, bottom, left], "name", "distance"}, ...]}. Nothing is
+    built or sent for frames nobody subscribed to.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self.stats = {"published": 0, "delivered": 0}
+
+    @property
+    def active(self):
+        return bool(self._subscriptions)
+
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, client_ids=None, names=None):
+        subscription = Subscription(client_ids, names)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+        subscription.close()
+
+    def publish(self, event):
+        self.stats["published"] += 1
+        for subscription in self._subscriptions:
+            filtered = subscription.filter(event)
+            if filtered is not None:
+                subscription.put(filtered)
+                self.stats["delivered"] += 1
+
+
+def sse_message(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def parse_filter(values):
+    """A filter set from query values like ["a,b", "c"], or None when empty"""
+    if isinstance(values, str):
+        values = [values]
+    items = {item for value in values for item in value.split(",") if item}
+    return items or None
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import Future
+import dlib
+import numpy as np
+from face_recognition import api as face_api
+
+MAX_BATCH_FACES = 32      # flush once this many faces are queued
+MAX_BATCH_DELAY = 0.020   # or once the oldest request has waited this long (seconds)
+LATENCY_SLO = 0.050       # submit-to-result target per request (seconds)
+STATS_INTERVAL = 60       # seconds between batching summaries
+CHIP_SIZE = 150           # aligned face chip expected by the dlib ResNet encoder
+CHIP_PADDING = 0.25
+
+
+class EncodeBatcher:
+    """Collects faces from every camera and encodes/matches them in batches.
+
+    submit() queues one frame's face boxes and returns a Future of their
+    (name, distance) matches. A background thread flushes when MAX_BATCH_FACES faces are queued
+    or the oldest request reaches its deadline, whichever comes first. The
+    deadline is pulled forward when the expected batch time would otherwise
+    push that request past the latency SLO. Each flush aligns all faces,
+    runs one batched dlib descriptor call and one gallery match.
+    """
+
+    def __init__(self, gallery_store, max_faces=MAX_BATCH_FACES, max_delay=MAX_BATCH_DELAY, slo=LATENCY_SLO):
+        self.gallery_store = gallery_store
+        self.max_faces = max_faces
+        self.max_delay = max_delay
+        self.slo = slo
+        self.stats = {"batches": 0, "faces": 0, "slo_misses": 0, "max_latency": 0.0}
+        self._cond = threading.Condition()
+        self._queue = []  # (submitted_at, image, boxes, future)
+        self._queued_faces = 0
+        self._batch_time = 0.0  # moving average of flush duration
+        self._last_report = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, boxes):
+        """Queue the (top, right, bottom, left) boxes of an RGB image for encoding"""
+        future = Future()
+        if not boxes:
+            future.set_result([])
+            return future
+        with self._cond:
+            self._queue.append((time.perf_counter(), image, list(boxes), future))
+            self._queued_faces += len(boxes)
+            self._cond.notify()
+        return future
+
+    def _take_batch(self):
+        batch = []
+        faces = 0
+        while self._queue and (not batch or faces + len(self._queue[0][2]) <= self.max_faces):
+            request = self._queue.pop(0)
+            batch.append(request)
+            faces += len(request[2])
+        self._queued_faces -= faces
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                first = self._queue[0][0]
+                deadline = min(first + self.max_delay, first + self.slo - self._batch_time)
+                while self._queued_faces < self.max_faces:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            chips = []
+            for _, image, boxes, _ in batch:
+                for top, right, bottom, left in boxes:
+                    shape = face_api.pose_predictor_5_point(image, dlib.rectangle(left, top, right, bottom))
+                    chips.append(dlib.get_face_chip(image, shape, size=CHIP_SIZE, padding=CHIP_PADDING))
+            encodings = [np.array(d) for d in face_api.face_encoder.compute_face_descriptor(chips)]
+            matches = self.gallery_store.gallery.best_matches(encodings)
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        done = time.perf_counter()
+        self._batch_time = 0.8 * self._batch_time + 0.2 * (done - started)
+        offset = 0
+        for submitted_at, _, boxes, future in batch:
+            future.set_result(matches[offset:offset + len(boxes)])
+            offset += len(boxes)
+            latency = done - submitted_at
+            self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+            if latency > self.slo:
+                self.stats["slo_misses"] += 1
+        self.stats["batches"] += 1
+        self.stats["faces"] += len(matches)
+
+        if time.time() - self._last_report >= STATS_INTERVAL:
+            s = self.stats
+            print(f"Encode batching: {s['faces']} faces in {s['batches']} batches "
+                  f"(avg {s['faces'] / s['batches']:.1f}), {s['slo_misses']} SLO misses, "
+                  f"max latency {s['max_latency'] * 1000:.1f} ms")
+            self._last_report = time.time()
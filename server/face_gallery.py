@@ -0,0 +1,330 @@
+import json
+import os
+import pickle
+import uuid
+import numpy as np
+from ann_index import INDEX_FILE, kmeans, load_index
+
+GALLERY_FILE = "face_gallery.json"
+GALLERY_FORMAT = "garud-gallery"
+GALLERY_VERSION = 2  # 2 adds raw samples and per-identity radii
+ARRAY_KEYS = ("encodings", "sq_norms", "ids", "samples", "sample_ids", "radii")
+LEGACY_ENCODINGS_FILE = "face_encodings.pkl"
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.float32
+MATCH_THRESHOLD = 0.5
+UNKNOWN_NAME = "Unknown"
+MAX_CENTROIDS = 4          # centroids kept per identity
+SAMPLES_PER_CENTROID = 5   # enrollment images summarised by each centroid
+REFINE_MARGIN = 0.08       # centroid matches closer than threshold - margin skip refinement
+REFINE_CANDIDATES = 8      # nearest centroids considered when refining against raw samples
+
+
+def cluster_samples(samples):
+    """Centroids and radius summarising one identity's enrollment encodings.
+
+    The radius is the largest distance from a sample to its centroid, so the
+    nearest raw sample is never closer than (centroid distance - radius).
+    """
+    samples = np.asarray(samples, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+    count = min(MAX_CENTROIDS, -(-len(samples) // SAMPLES_PER_CENTROID))
+    if count <= 1:
+        centroids = samples.mean(axis=0, keepdims=True)
+    else:
+        centroids = kmeans(samples, count).astype(ENCODING_DTYPE)
+    d = np.linalg.norm(samples[:, np.newaxis, :] - centroids[np.newaxis, :, :], axis=2)
+    return centroids, float(d.min(axis=1).max())
+
+
+class FaceGallery:
+    """Known face encodings scored in one matrix operation per frame.
+
+    Rows are stored as an (N, 128) matrix plus `ids`, the identity number of
+    each row into `identity_names`. Galleries are never modified in place, so
+    the matrix may be a read-only memory map shared between processes.
+
+    Galleries built with from_samples() hold a few cluster centroids per
+    identity as rows, and keep the raw enrollment `samples` (grouped by
+    `sample_ids`) plus a per-identity `radii` bound. Matching scans only the
+    centroids and falls back to the raw samples for results near the threshold.
+    """
+
+    def __init__(self, encodings, names, threshold=MATCH_THRESHOLD, index=None):
+        lookup = {}
+        ids = np.fromiter((lookup.setdefault(n, len(lookup)) for n in names), dtype=np.int32, count=len(names))
+        self._init(np.asarray(encodings, dtype=ENCODING_DTYPE).reshape(len(names), ENCODING_DIM),
+                   ids, list(lookup), None, threshold, index)
+
+    @classmethod
+    def from_arrays(cls, encodings, ids, identity_names, sq_norms=None, threshold=MATCH_THRESHOLD, index=None,
+                    samples=None, sample_ids=None, radii=None):
+        """Wrap existing arrays (e.g. memory maps) without copying them"""
+        gallery = cls.__new__(cls)
+        gallery._init(encodings, ids, identity_names, sq_norms, threshold, index, samples, sample_ids, radii)
+        return gallery
+
+    @classmethod
+    def from_samples(cls, samples_by_name, threshold=MATCH_THRESHOLD):
+        """Cluster every identity's enrollment encodings into centroids"""
+        identity_names = list(samples_by_name)
+        centroids, ids, samples, sample_ids, radii = [], [], [], [], []
+        for name_id, name in enumerate(identity_names):
+            raw = np.asarray(samples_by_name[name], dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+            c, radius = cluster_samples(raw)
+            centroids.append(c)
+            ids.append(np.full(len(c), name_id, dtype=np.int32))
+            samples.append(raw)
+            sample_ids.append(np.full(len(raw), name_id, dtype=np.int32))
+            radii.append(radius)
+
+        def stack(parts, dtype, width=None):
+            if parts:
+                return np.concatenate(parts).astype(dtype, copy=False)
+            return np.empty((0, width) if width else 0, dtype=dtype)
+
+        return cls.from_arrays(stack(centroids, ENCODING_DTYPE, ENCODING_DIM), stack(ids, np.int32), identity_names,
+                               threshold=threshold, samples=stack(samples, ENCODING_DTYPE, ENCODING_DIM),
+                               sample_ids=stack(sample_ids, np.int32), radii=np.asarray(radii, dtype=ENCODING_DTYPE))
+
+    def _init(self, encodings, ids, identity_names, sq_norms, threshold, index,
+              samples=None, sample_ids=None, radii=None):
+        self.encodings = encodings
+        self.ids = ids
+        self.identity_names = identity_names
+        self.threshold = threshold
+        # ||b||^2 for every gallery row, reused by every query
+        self.sq_norms = sq_norms if sq_norms is not None else np.einsum("ij,ij->i", encodings, encodings)
+        # Optional ann_index.IVFIndex; when set, top_k only scans the probed lists
+        self.index = index
+        # Raw enrollment samples sorted by identity; samples of identity i are
+        # samples[sample_offsets[i]:sample_offsets[i + 1]]
+        self.samples = samples
+        self.sample_ids = sample_ids
+        self.radii = radii
+        if samples is not None:
+            self.sample_offsets = np.searchsorted(sample_ids, np.arange(len(identity_names) + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def names(self):
+        """Name of every row"""
+        return [self.identity_names[i] for i in self.ids]
+
+    def identities(self):
+        """Names that have at least one row"""
+        return [self.identity_names[i] for i in np.unique(self.ids)]
+
+    def replace_identity(self, name, encodings):
+        """New gallery with every entry for name replaced by encodings; an empty
+        list removes the identity. The original gallery is left untouched."""
+        raw = np.asarray(encodings, dtype=self.encodings.dtype).reshape(-1, ENCODING_DIM)
+        identity_names = list(self.identity_names)
+        try:
+            name_id = identity_names.index(name)
+        except ValueError:
+            name_id = len(identity_names)
+            identity_names.append(name)
+
+        samples = sample_ids = radii = None
+        new = raw
+        if self.samples is not None:
+            radii = np.append(self.radii, np.zeros(len(identity_names) - len(self.radii), dtype=self.radii.dtype))
+            if len(raw):
+                new, radii[name_id] = cluster_samples(raw)
+            else:
+                radii[name_id] = 0.0
+            keep_samples = self.sample_ids != name_id
+            sample_ids = np.concatenate([self.sample_ids[keep_samples],
+                                         np.full(len(raw), name_id, dtype=self.sample_ids.dtype)])
+            order = np.argsort(sample_ids, kind="stable")
+            sample_ids = sample_ids[order]
+            samples = np.concatenate([self.samples[keep_samples], raw])[order]
+
+        keep = self.ids != name_id
+        ids = np.concatenate([self.ids[keep], np.full(len(new), name_id, dtype=self.ids.dtype)])
+        sq_norms = np.concatenate([self.sq_norms[keep], np.einsum("ij,ij->i", new, new)])
+        index = self.index.updated(keep, new) if self.index is not None else None
+        return FaceGallery.from_arrays(np.concatenate([self.encodings[keep], new]), ids, identity_names,
+                                       sq_norms, self.threshold, index, samples, sample_ids, radii)
+
+    def distances(self, queries):
+        """Euclidean distance matrix of shape (num_queries, gallery_size)"""
+        q = np.asarray(queries, dtype=self.encodings.dtype)
+        if q.ndim == 1:
+            q = q[np.newaxis, :]
+        # ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab
+        d = q @ self.encodings.T
+        d *= -2.0
+        d += self.sq_norms[np.newaxis, :]
+        d += np.einsum("ij,ij->i", q, q)[:, np.newaxis]
+        np.maximum(d, 0.0, out=d)
+        return np.sqrt(d, out=d)
+
+    def top_k(self, queries, k=1):
+        """Indices and distances of the k nearest gallery entries per query, nearest first"""
+        if self.index is not None:
+            return self.index.search(queries, self.encodings, self.sq_norms, k)
+        d = self.distances(queries)
+        n = d.shape[0]
+        k = min(k, len(self))
+        if n == 0 or k == 0:
+            return np.empty((n, 0), dtype=np.intp), np.empty((n, 0), dtype=d.dtype)
+        if k < d.shape[1]:
+            idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.broadcast_to(np.arange(d.shape[1]), d.shape).copy()
+        part = np.take_along_axis(d, idx, axis=1)
+        order = np.argsort(part, axis=1)
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+    def match(self, queries, k=1):
+        """List of [(name, distance), ...] per query, nearest first"""
+        idx, dist = self.top_k(queries, k)
+        return [[(self.identity_names[self.ids[i]], float(dd)) for i, dd in zip(row_i, row_d) if i >= 0]
+                for row_i, row_d in zip(idx, dist)]
+
+    def identify(self, queries):
+        """Best name per query, or UNKNOWN_NAME when nothing is within the threshold"""
+        return [name for name, _ in self.best_matches(queries)]
+
+    def best_matches(self, queries):
+        """Best (name, distance) per query; (UNKNOWN_NAME, None) when nothing is within the threshold"""
+        matches = [(UNKNOWN_NAME, None)] * len(queries)
+        valid = [i for i, q in enumerate(queries) if np.size(q) > 0]
+        if not valid or len(self) == 0:
+            return matches
+        q = np.stack([queries[i] for i in valid])
+        if self.samples is None:
+            idx, dist = self.top_k(q, k=1)
+            for i, best, best_dist in zip(valid, idx[:, 0], dist[:, 0]):
+                if best_dist <= self.threshold:
+                    matches[i] = (self.identity_names[self.ids[best]], float(best_dist))
+            return matches
+
+        idx, dist = self.top_k(q, k=REFINE_CANDIDATES)
+        for i, query, row_idx, row_dist in zip(valid, q, idx, dist):
+            if row_idx[0] < 0:
+                continue
+            if row_dist[0] <= self.threshold - REFINE_MARGIN:
+                matches[i] = (self.identity_names[self.ids[row_idx[0]]], float(row_dist[0]))
+                continue
+            name_id, name_dist = self._refine(query, row_idx, row_dist)
+            if name_id is not None:
+                matches[i] = (self.identity_names[name_id], name_dist)
+        return matches
+
+    def _refine(self, query, row_idx, row_dist):
+        """(identity, distance) of the nearest raw sample within the threshold, or (None, None).
+
+        Only identities whose centroid distance minus radius could still be
+        within the threshold are scanned.
+        """
+        candidates = []
+        for row, d in zip(row_idx, row_dist):
+            if row < 0:
+                break
+            name_id = self.ids[row]
+            if d - self.radii[name_id] <= self.threshold and name_id not in candidates:
+                candidates.append(name_id)
+        best_id, best_dist = None, self.threshold
+        for name_id in candidates:
+            raw = self.samples[self.sample_offsets[name_id]:self.sample_offsets[name_id + 1]]
+            if len(raw) == 0:
+                continue
+            d = float(np.sqrt(np.min(np.sum((raw - query.astype(raw.dtype)) ** 2, axis=1))))
+            if d <= best_dist:
+                best_id, best_dist = name_id, d
+        return (best_id, best_dist) if best_id is not None else (None, None)
+
+
+def save_gallery(gallery, path=GALLERY_FILE):
+    """Write gallery as a manifest plus contiguous .npy arrays next to it.
+
+    Array files carry a fresh generation tag and the manifest is replaced
+    last, so readers see either the old or the new gallery, never a mix.
+    Processes that still map the previous generation keep their pages.
+    Returns the generation, for build_index() to tag the index with.
+    """
+    base = os.path.splitext(path)[0]
+    generation = uuid.uuid4().hex[:12]
+    manifest = {
+        "format": GALLERY_FORMAT,
+        "version": GALLERY_VERSION,
+        "generation": generation,
+        "count": len(gallery),
+        "dim": ENCODING_DIM,
+        "dtype": np.dtype(ENCODING_DTYPE).name,
+        "names": list(gallery.identity_names),
+    }
+    arrays = {
+        "encodings": np.ascontiguousarray(gallery.encodings, dtype=ENCODING_DTYPE),
+        "sq_norms": np.ascontiguousarray(gallery.sq_norms, dtype=ENCODING_DTYPE),
+        "ids": np.ascontiguousarray(gallery.ids, dtype=np.int32),
+    }
+    if gallery.samples is not None:
+        arrays["samples"] = np.ascontiguousarray(gallery.samples, dtype=ENCODING_DTYPE)
+        arrays["sample_ids"] = np.ascontiguousarray(gallery.sample_ids, dtype=np.int32)
+        arrays["radii"] = np.ascontiguousarray(gallery.radii, dtype=ENCODING_DTYPE)
+    for key, array in arrays.items():
+        filename = f"{base}.{generation}.{key}.npy"
+        np.save(filename, array)
+        manifest[key] = os.path.basename(filename)
+
+    previous = None
+    if os.path.exists(path):
+        try:
+            previous = _read_manifest(path)
+        except Exception:
+            pass
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+    if previous:
+        for key in ARRAY_KEYS:
+            try:
+                os.remove(os.path.join(os.path.dirname(path), previous[key]))
+            except (KeyError, OSError):
+                pass
+    return generation
+
+
+def _read_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != GALLERY_FORMAT:
+        raise ValueError(f"{path} is not a gallery manifest")
+    if manifest.get("version") not in (1, GALLERY_VERSION):
+        raise ValueError(f"Unsupported gallery version {manifest.get('version')}")
+    return manifest
+
+
+def load_gallery(path=GALLERY_FILE, index_file=INDEX_FILE):
+    """Open the enrolled gallery zero-copy and attach the ANN index if one matches it.
+
+    Falls back to the legacy face_encodings.pkl when no manifest exists yet.
+    """
+    legacy_file = os.path.join(os.path.dirname(path), LEGACY_ENCODINGS_FILE)
+    if not os.path.exists(path) and os.path.exists(legacy_file):
+        print(f"{path} not found, loading legacy {legacy_file}")
+        with open(legacy_file, "rb") as f:
+            data = pickle.load(f)
+        return FaceGallery(data["encodings"], data["names"],
+                           index=load_index(index_file, len(data["names"])))
+
+    manifest = _read_manifest(path)
+    directory = os.path.dirname(path)
+    arrays = {key: np.load(os.path.join(directory, manifest[key]), mmap_mode="r")
+              for key in ARRAY_KEYS if key in manifest}
+    count = manifest["count"]
+    if arrays["encodings"].shape != (count, manifest["dim"]) or len(arrays["ids"]) != count \
+            or len(arrays["sq_norms"]) != count:
+        raise ValueError(f"Gallery arrays do not match manifest {path}")
+    print(f"Mapped {count} face encodings for {len(manifest['names'])} identities from {path} "
+          f"(generation {manifest['generation']})")
+    return FaceGallery.from_arrays(arrays["encodings"], arrays["ids"], manifest["names"], arrays["sq_norms"],
+                                   index=load_index(index_file, count, manifest["generation"]), samples=arrays.get("samples"),
+                                   sample_ids=arrays.get("sample_ids"), radii=arrays.get("radii"))
@@ -0,0 +1,105 @@
+import itertools
+from face_gallery import UNKNOWN_NAME
+
+IOU_MATCH = 0.3           # minimum overlap to continue a track
+CENTROID_MATCH = 0.5      # or centre shift as a fraction of the box size
+MAX_MISSES = 5            # frames a track survives without a detection
+REVERIFY_INTERVAL = 5.0   # seconds before a known identity is re-encoded
+UNKNOWN_RECHECK = 1.0     # seconds before an unknown face is re-encoded
+
+
+class Track:
+    """One face followed across frames, with its cached identity"""
+    __slots__ = ("track_id", "box", "name", "distance", "verified_at", "misses")
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box          # (top, right, bottom, left), like face_recognition
+        self.name = None        # None until the first encoding
+        self.distance = None    # gallery distance of name, None while unknown
+        self.verified_at = 0.0
+        self.misses = 0
+
+
+def iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def centroid_shift(a, b):
+    """Centre distance relative to the larger box side"""
+    dx = (a[1] + a[3] - b[1] - b[3]) / 2.0
+    dy = (a[0] + a[2] - b[0] - b[2]) / 2.0
+    size = max(a[1] - a[3], a[2] - a[0], b[1] - b[3], b[2] - b[0], 1)
+    return (dx * dx + dy * dy) ** 0.5 / size
+
+
+class FaceTracker:
+    """Associates per-frame face boxes with stable track ids.
+
+    Boxes are matched greedily by IoU, falling back to centre distance for
+    fast motion at low frame rates. Callers encode only the tracks returned by
+    needs_encoding() and store the result with assign().
+    """
+
+    def __init__(self, reverify_interval=REVERIFY_INTERVAL, unknown_recheck=UNKNOWN_RECHECK):
+        self.tracks = []
+        self.reverify_interval = reverify_interval
+        self.unknown_recheck = unknown_recheck
+        self._ids = itertools.count(1)
+
+    def update(self, boxes):
+        """Track for every box, in the same order as boxes"""
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for bi, box in enumerate(boxes):
+                overlap = iou(track.box, box)
+                if overlap >= IOU_MATCH:
+                    pairs.append((overlap, ti, bi))
+                elif centroid_shift(track.box, box) <= CENTROID_MATCH:
+                    # Rank centre matches below any IoU match
+                    pairs.append((-centroid_shift(track.box, box), ti, bi))
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, ti, bi in pairs:
+            if ti in used_tracks or assigned[bi] is not None:
+                continue
+            track = self.tracks[ti]
+            track.box = boxes[bi]
+            track.misses = 0
+            assigned[bi] = track
+            used_tracks.add(ti)
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+                if track.misses > MAX_MISSES:
+                    continue
+            survivors.append(track)
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is None:
+                assigned[bi] = Track(next(self._ids), box)
+                survivors.append(assigned[bi])
+        self.tracks = survivors
+        return assigned
+
+    def needs_encoding(self, track, now):
+        """New tracks, unknown faces and identities due for re-verification"""
+        if track.name is None:
+            return True
+        interval = self.unknown_recheck if track.name == UNKNOWN_NAME else self.reverify_interval
+        return now - track.verified_at >= interval
+
+    def assign(self, track, name, now, distance=None):
+        track.name = name
+        track.distance = distance
+        track.verified_at = now
@@ -0,0 +1,106 @@
+import cv2
+import face_recognition
+from face_gallery import UNKNOWN_NAME
+from face_tracker import FaceTracker
+from frame_codec import LazyFrame
+from motion_gate import MotionGate, detect_in_regions
+
+DETECTION_SCALE = 4  # HOG runs on a 1/4 size frame
+ENCODE_TIMEOUT = 5   # seconds to wait for a batched encode
+
+
+def _to_rgb(image):
+    """Robust color conversion of a BGR/BGRA/grey image, None passes through"""
+    if image is None:
+        return None
+    if image.ndim == 2:  # Grayscale
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:  # BGRA format
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Assume BGR
+
+
+class FrameAnalyzer:
+    """Per-camera recognition state: motion-gated detection, tracking and matching.
+
+    analyze() takes a LazyFrame or a BGR/BGRA/grey uint8 frame and returns a
+    list of ((top, right, bottom, left), name, distance) in full-frame
+    coordinates, distance being None for unknown faces, or None if the frame
+    could not be used. It does not modify the frame. A
+    JPEG LazyFrame is decoded at full resolution only when a face has to be
+    encoded.
+    """
+
+    def __init__(self, gallery_store, batcher=None):
+        self.gallery_store = gallery_store
+        # Optional EncodeBatcher shared with other cameras
+        self.batcher = batcher
+        self.tracker = FaceTracker()
+        self.motion_gate = MotionGate()
+        self.face_locations_small = []
+
+    def analyze(self, frame, now):
+        if not isinstance(frame, LazyFrame):
+            frame = LazyFrame.from_image(frame)
+
+        # Detection works on a 1/4 size frame, decoded at that size from the JPEG when possible
+        try:
+            small_rgb_frame = _to_rgb(frame.reduced(DETECTION_SCALE))
+            if small_rgb_frame is None or small_rgb_frame.size == 0:
+                print("Reduced frame is empty or could not be decoded")
+                return None
+        except Exception as e:
+            print(f"Frame conversion error: {e}")
+            return None
+
+        # Face detection, only where the scene changed since the last frames
+        s = DETECTION_SCALE
+        try:
+            regions = self.motion_gate.regions(small_rgb_frame, now)
+            self.face_locations_small = detect_in_regions(
+                lambda image: face_recognition.face_locations(image, model="hog"),
+                small_rgb_frame, regions, self.face_locations_small
+            )
+            face_locations = [(top*s, right*s, bottom*s, left*s)
+                              for (top, right, bottom, left) in self.face_locations_small]
+        except Exception as e:
+            print(f"Face location error: {e}")
+            self.face_locations_small = []
+            face_locations = []
+
+        # Follow faces across frames; only new, unknown or stale tracks are encoded
+        tracks = self.tracker.update(face_locations)
+        to_encode = [t for t in tracks if self.tracker.needs_encoding(t, now)]
+        if to_encode:
+            boxes = [t.box for t in to_encode]
+            # Encoding needs full resolution; only now is the full frame decoded
+            try:
+                rgb_frame = _to_rgb(frame.full())
+            except Exception as e:
+                print(f"Frame conversion error: {e}")
+                rgb_frame = None
+            if rgb_frame is None:
+                matches = []
+            elif self.batcher is not None:
+                try:
+                    matches = self.batcher.submit(rgb_frame, boxes).result(timeout=ENCODE_TIMEOUT)
+                except Exception as e:
+                    print(f"Batched recognition error: {e}")
+                    matches = []
+            else:
+                encodings = []
+                try:
+                    encodings = face_recognition.face_encodings(rgb_frame, boxes, model="small")
+                except Exception as e:
+                    print(f"Encoding error: {e}")
+
+                # Match every face in the frame against the gallery at once
+                try:
+                    matches = self.gallery_store.gallery.best_matches(encodings)
+                except Exception as e:
+                    print(f"Recognition error: {e}")
+                    matches = [(UNKNOWN_NAME, None)] * len(encodings)
+            for track, (name, distance) in zip(to_encode, matches):
+                self.tracker.assign(track, name, now, distance)
+
+        return [(box, track.name or UNKNOWN_NAME, track.distance) for box, track in zip(face_locations, tracks)]
@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+JPEG_SOI = b"\xff\xd8"
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def is_jpeg(data):
+    return len(data) > 2 and data[:2] == JPEG_SOI
+
+
+class LazyFrame:
+    """A camera frame decoded only as far as it is used.
+
+    Built from JPEG bytes, reduced() decodes straight to 1/scale size in the
+    DCT domain (IMREAD_REDUCED_COLOR_*), which is much cheaper than a full
+    decode followed by a resize. full() decodes at full resolution once and
+    caches it. Built from an already decoded image, both are served from it.
+    """
+    __slots__ = ("data", "_full", "_reduced", "_reduced_scale")
+
+    def __init__(self, data=None, image=None):
+        self.data = data
+        self._full = image
+        self._reduced = None
+        self._reduced_scale = None
+
+    @classmethod
+    def from_jpeg(cls, data):
+        return cls(data=data)
+
+    @classmethod
+    def from_image(cls, image):
+        return cls(image=image)
+
+    @property
+    def decoded(self):
+        return self._full is not None
+
+    def full(self):
+        """Full-resolution BGR (or the original image), None if the JPEG is invalid"""
+        if self._full is None and self.data is not None:
+            self._full = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._full
+
+    def reduced(self, scale):
+        """Image at 1/scale size, None if the JPEG is invalid"""
+        if self._reduced is None or self._reduced_scale != scale:
+            if self._full is None and self.data is not None and scale in REDUCED_FLAGS:
+                self._reduced = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), REDUCED_FLAGS[scale])
+            else:
+                full = self.full()
+                self._reduced = None if full is None else cv2.resize(full, (0, 0), fx=1.0 / scale, fy=1.0 / scale)
+            self._reduced_scale = scale
+        return self._reduced
@@ -0,0 +1,121 @@
+import json
+import struct
+
+# Frame header sent ahead of each JPEG by clients that negotiated the envelope:
+# magic, version, codec flags, sequence number, capture time (Unix seconds), width, height
+HEADER = struct.Struct("!2sBBIdHH")
+MAGIC = b"GF"
+VERSION = 1
+FLAG_JPEG = 0x01
+SEQ_MODULO = 1 << 32
+CONTROL_VERSION = 1  # server-to-camera {"type": "control", ...} text messages
+
+# Multiplexed gateway connections carry many cameras, each binary message
+# prefixed with the channel it belongs to; channels are opened and closed with
+# {"type": "open"/"close", "channel": ...} text messages
+MUX_VERSION = 1
+CHANNEL_HEADER = struct.Struct("!H")
+MAX_CHANNEL = (1 << 16) - 1
+
+
+def pack_frame(seq, captured_at, width, height, payload, flags=FLAG_JPEG):
+    return HEADER.pack(MAGIC, VERSION, flags, seq % SEQ_MODULO, captured_at, width, height) + payload
+
+
+def unpack_frame(message):
+    """Split an enveloped frame into (header dict, payload memoryview); raises ValueError if malformed"""
+    if len(message) <= HEADER.size:
+        raise ValueError("frame shorter than its header")
+    magic, version, flags, seq, captured_at, width, height = HEADER.unpack_from(message)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"unknown frame header {magic!r} v{version}")
+    header = {"flags": flags, "seq": seq, "captured_at": captured_at, "width": width, "height": height}
+    return header, memoryview(message)[HEADER.size:]
+
+
+def pack_channel(channel, payload):
+    return CHANNEL_HEADER.pack(channel) + payload
+
+
+def unpack_channel(message):
+    """Split a multiplexed message into (channel, payload memoryview); raises ValueError if malformed"""
+    if len(message) <= CHANNEL_HEADER.size:
+        raise ValueError("message shorter than its channel header")
+    channel, = CHANNEL_HEADER.unpack_from(message)
+    return channel, memoryview(message)[CHANNEL_HEADER.size:]
+
+
+def hello_options(hello):
+    """The options of a JSON hello (or mux open message) that the server supports"""
+    return {
+        "envelope": VERSION if hello.get("envelope") == VERSION else None,
+        "control": CONTROL_VERSION if hello.get("control") == CONTROL_VERSION else None,
+        "max_resolution": tuple(int(v) for v in hello["max_resolution"]) if hello.get("max_resolution") else None,
+        "mux": MUX_VERSION if hello.get("mux") == MUX_VERSION else None
+    }
+
+
+def parse_hello(message):
+    """Read a registration message: a bare client_id, or a JSON hello.
+
+    The JSON form is {"client_id": ..., "envelope": VERSION, "control": CONTROL_VERSION,
+    "max_resolution": [width, height], "mux": MUX_VERSION}, every key but
+    client_id optional; a gateway asking for mux names itself in client_id.
+    Returns (client_id, options) with the options the server supports.
+    """
+    if isinstance(message, str) and message.startswith("{"):
+        hello = json.loads(message)
+        return hello["client_id"], hello_options(hello)
+    if isinstance(message, bytes):
+        message = message.decode()
+    return message, {"envelope": None, "control": None, "max_resolution": None, "mux": None}
+
+
+class SequenceTracker:
+    """Counts lost and out-of-order frames from 32-bit wrapping sequence numbers,
+    and maps the camera's capture clock onto server time for one connection"""
+
+    def __init__(self):
+        self.last = None
+        self.lost = 0
+        self.reordered = 0
+        self.clock_offset = None  # smallest arrival minus capture time seen, in seconds
+
+    def update(self, seq):
+        """Record seq; returns False for a frame older than one already seen"""
+        if self.last is not None:
+            gap = (seq - self.last) % SEQ_MODULO
+            if gap == 0 or gap >= SEQ_MODULO // 2:
+                self.reordered += 1
+                return False
+            self.lost += gap - 1
+        self.last = seq
+        return True
+
+    def captured_at(self, camera_time, now):
+        """Map a capture timestamp from the camera's clock onto server time.
+
+        Camera clocks may be anywhere relative to ours, so as for MJPEG pulls
+        the smallest arrival minus capture offset seen is taken as the skew:
+        the fastest frame counts as delivered instantly and ages are relative
+        to it, absorbing the skew but not the fixed network delay.
+        """
+        offset = now - camera_time
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        return camera_time + self.clock_offset
+
+
+def fit_resolution(width, height, settings):
+    """Size a width x height frame should be sent at under a control message's resolution.
+
+    The requested width and height bound the frame; it is scaled down to fit
+    them keeping its own aspect ratio, so faces are never squashed, and is
+    never scaled up. Returns None when the frame already fits.
+    """
+    if not settings.get("width") or not settings.get("height"):
+        return None
+    scale = min(settings["width"] / width, settings["height"] / height)
+    if scale >= 1:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
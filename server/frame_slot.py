@@ -0,0 +1,56 @@
+import threading
+
+
+class LatestFrameSlot:
+    """Single-frame handoff between a camera connection and its processor.
+
+    put() replaces any frame the processor has not taken yet, so the
+    processor always works on the newest frame and is at most one frame
+    behind. Frames are stored as received (JPEG bytes) and only the ones
+    taken are ever decoded. overwritten counts the frames replaced unseen.
+    on_take, when set, is called (from the taking thread) after each take,
+    and on_close once (from the closing thread) when the slot is closed.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.overwritten = 0
+        self.taken = 0
+        self.on_take = None
+        self.on_close = None
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.overwritten += 1
+            self._frame = frame
+            self.received += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Take the newest frame, or None on timeout or once the slot is closed"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self._closed, timeout)
+            frame, self._frame = self._frame, None
+            if frame is not None:
+                self.taken += 1
+            on_take = self.on_take
+        if frame is not None and on_take is not None:
+            on_take()
+        return frame
+
+    def close(self):
+        with self._cond:
+            was_closed, self._closed = self._closed, True
+            self._frame = None
+            self._cond.notify_all()
+            on_close = self.on_close
+        if not was_closed and on_close is not None:
+            on_close()
+
+    @property
+    def closed(self):
+        return self._closed
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import requests
+import face_recognition
+from face_gallery import GALLERY_FILE, load_gallery
+from ann_index import INDEX_FILE
+
+WATCH_INTERVAL = 2  # seconds between gallery file checks
+IMAGE_FETCH_TIMEOUT = 10
+
+
+class GalleryStore:
+    """Holds the live FaceGallery and swaps in updated copies atomically.
+
+    Readers take `store.gallery` once per frame and keep using that snapshot;
+    a FaceGallery is never modified after construction, so a reader can never
+    observe a half-updated matrix. Writers build a new gallery off to the side
+    under `_write_lock` and publish it with a single attribute assignment.
+    """
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+        self.version = 0
+        self._write_lock = threading.Lock()
+        # Live edits (name -> encodings, empty to remove) re-applied on file reloads
+        self._overrides = {}
+        # Called as listener(name, encodings) after every live edit
+        self.listeners = []
+
+    def _publish(self, gallery):
+        self.gallery = gallery
+        self.version += 1
+
+    def replace(self, name, encodings):
+        """Add, replace or (with no encodings) remove one identity"""
+        encodings = [np.asarray(e) for e in encodings]
+        with self._write_lock:
+            self._overrides[name] = encodings
+            self._publish(self.gallery.replace_identity(name, encodings))
+        print(f"Gallery v{self.version}: {name} -> {len(encodings)} encoding(s), {len(self.gallery)} total")
+        for listener in self.listeners:
+            try:
+                listener(name, encodings)
+            except Exception as e:
+                print(f"Gallery listener error: {e}")
+
+    def remove(self, name):
+        self.replace(name, [])
+
+    def reload(self, gallery_file=GALLERY_FILE, index_file=INDEX_FILE):
+        """Swap in the gallery from disk, keeping live edits made since startup"""
+        gallery = load_gallery(gallery_file, index_file)
+        with self._write_lock:
+            for name, encodings in self._overrides.items():
+                gallery = gallery.replace_identity(name, encodings)
+            self._publish(gallery)
+        print(f"Gallery v{self.version}: reloaded {len(self.gallery)} encodings from {gallery_file}")
+
+    def watch(self, gallery_file=GALLERY_FILE, index_file=INDEX_FILE, interval=WATCH_INTERVAL):
+        """Start a daemon thread that reloads the gallery when its files change"""
+        def mtimes():
+            return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None
+                         for p in (gallery_file, index_file))
+
+        def loop():
+            last = mtimes()
+            while True:
+                time.sleep(interval)
+                current = mtimes()
+                if current == last:
+                    continue
+                # Let preprocess_faces.py finish writing both files
+                time.sleep(interval)
+                if mtimes() != current:
+                    continue
+                last = current
+                try:
+                    self.reload(gallery_file, index_file)
+                except Exception as e:
+                    print(f"Gallery reload error: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+
+def encode_image_bytes(data):
+    """Encoding of the first face in an encoded image, or None"""
+    bgr_img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr_img is None:
+        return None
+    rgb_img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
+    encoding = face_recognition.face_encodings(rgb_img)
+    return encoding[0] if encoding else None
+
+
+def sync_criminals(db, store):
+    """Mirror the Firestore `criminals` collection into the gallery.
+
+    Each document id is the gallery name (handle_known_face_detection looks
+    criminals up by it); its `images[].url` entries are downloaded and encoded.
+    Returns the Firestore watch so the caller can unsubscribe.
+    """
+    seen_updates = {}
+
+    def encode_criminal(doc):
+        encodings = []
+        for image in doc.get("images", []):
+            url = image.get("url")
+            if not url:
+                continue
+            try:
+                response = requests.get(url, timeout=IMAGE_FETCH_TIMEOUT)
+                response.raise_for_status()
+                encoding = encode_image_bytes(response.content)
+            except Exception as e:
+                print(f"Error fetching criminal image {url}: {e}")
+                continue
+            if encoding is None:
+                print(f"Warning: No face found in image {url}")
+            else:
+                encodings.append(encoding)
+        return encodings
+
+    def on_snapshot(docs, changes, read_time):
+        enrolled = set(store.gallery.identities())
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED":
+                seen_updates.pop(doc.id, None)
+                store.remove(doc.id)
+                continue
+
+            data = doc.to_dict() or {}
+            updated_at = data.get("updated_at")
+            first_sight = doc.id not in seen_updates
+            if not first_sight and seen_updates[doc.id] == updated_at:
+                continue
+            seen_updates[doc.id] = updated_at
+            # The initial snapshot lists every criminal; ones already enrolled
+            # from the gallery file are trusted until they are modified
+            if first_sight and change.type.name == "ADDED" and doc.id in enrolled:
+                continue
+
+            encodings = encode_criminal(data)
+            if encodings:
+                store.replace(doc.id, encodings)
+            else:
+                print(f"Warning: No usable images for criminal {doc.id}, keeping current entry")
+
+    return db.collection("criminals").on_snapshot(on_snapshot)
@@ -0,0 +1,232 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from encode_batcher import EncodeBatcher
+from face_gallery import load_gallery
+from frame_analyzer import FrameAnalyzer
+from frame_codec import LazyFrame
+from gallery_store import GalleryStore
+
+SLOTS_PER_WORKER = 4                    # frames in flight per worker process
+MAX_FRAME_BYTES = 1920 * 1080 * 4       # largest frame a slot can hold
+SLOT_WAIT_TIMEOUT = 2.0                 # seconds to wait for a free slot
+WORKER_THREADS = SLOTS_PER_WORKER       # frames analysed concurrently, so their faces share encode batches
+
+
+def _worker_main(worker_index, slots, task_queue, results):
+    """Worker process: analyze frames for the cameras routed to this worker.
+
+    Frames are read in place from the shared-memory slots, either still JPEG
+    encoded or as raw pixels; only the small per-face results are sent back. Frames of different cameras are analysed
+    on a few threads so their faces meet in the worker's EncodeBatcher.
+    """
+    cv2.setNumThreads(1)
+    store = GalleryStore(load_gallery())
+    store.watch()
+    batcher = EncodeBatcher(store)
+    executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+    analyzers = {}
+    send_lock = threading.Lock()  # results is one pipe shared by the analysis threads
+    print(f"Inference worker {worker_index} started (pid {os.getpid()})")
+
+    def analyze(task_id, client_id, analyzer, slot, codec, shape, timestamp):
+        view = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+        frame = LazyFrame.from_jpeg(view) if codec == "jpeg" else LazyFrame.from_image(view)
+        try:
+            faces = analyzer.analyze(frame, timestamp)
+        except Exception as e:
+            print(f"Inference error for {client_id}: {e}")
+            faces = None
+        del frame, view  # release the slot view before the parent reuses it
+        with send_lock:
+            results.send((task_id, faces))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        kind = task[0]
+        if kind == "frame":
+            _, task_id, client_id, slot, codec, shape, timestamp = task
+            # process_frames() waits out a camera's frame before sending the next, so its analyzer is never shared
+            analyzer = analyzers.get(client_id)
+            if analyzer is None:
+                analyzer = analyzers[client_id] = FrameAnalyzer(store, batcher)
+            executor.submit(analyze, task_id, client_id, analyzer, slot, codec, shape, timestamp)
+        elif kind == "close":
+            analyzers.pop(task[1], None)
+        elif kind == "gallery":
+            store.replace(task[1], task[2])
+
+    executor.shutdown(wait=True)
+    for slot in slots:
+        slot.close()
+
+
+class InferencePool:
+    """Fixed pool of worker processes running FrameAnalyzer.
+
+    Each camera is pinned to one worker so its tracker and motion state stay
+    local. Frames are copied once into a shared-memory slot owned by that
+    worker, as JPEG bytes when they have not been decoded yet, and results come back as lists of (box, name, distance) tuples.
+
+    Workers are started through a forkserver, a clean process forked from
+    before the server's threads, locks and gRPC channels existed, so a
+    worker can be (re)started at any time. A worker that dies is replaced: the frames it held fail, its
+    slots are reclaimed and the live gallery edits are replayed to the new one.
+    """
+
+    def __init__(self, num_workers=None, slots_per_worker=SLOTS_PER_WORKER, max_frame_bytes=MAX_FRAME_BYTES):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.slots_per_worker = slots_per_worker
+        self.max_frame_bytes = max_frame_bytes
+        self._ctx = multiprocessing.get_context("forkserver")
+        self._ctx.set_forkserver_preload(["inference_pool"])  # imported once in the server, not per worker
+        self._workers = []
+        self._slots = []
+        self._free_slots = []
+        self._task_queues = []
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._task_ids = 0
+        self._overrides = {}  # name -> encodings of every live gallery edit, for replacement workers
+        self._stopping = False
+        self.restarts = 0
+
+    def start(self):
+        for w in range(self.num_workers):
+            slots = [shared_memory.SharedMemory(create=True, size=self.max_frame_bytes)
+                     for _ in range(self.slots_per_worker)]
+            free = queue.Queue()
+            for s in range(self.slots_per_worker):
+                free.put(s)
+            self._slots.append(slots)
+            self._free_slots.append(free)
+            task_queue, process = self._spawn(w)
+            self._task_queues.append(task_queue)
+            self._workers.append(process)
+        print(f"Inference pool started with {self.num_workers} workers")
+
+    def _spawn(self, w):
+        """Start worker w with its own task queue and result pipe, and a thread collecting its results.
+
+        Nothing is shared between workers, so one that dies mid-write cannot
+        leave a lock held for the others or its replacement.
+        """
+        task_queue = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(target=_worker_main, args=(w, self._slots[w], task_queue, writer), daemon=True)
+        process.start()
+        writer.close()  # the worker holds the only write end, so its exit ends the pipe
+        threading.Thread(target=self._collect_results, args=(w, process, reader), daemon=True).start()
+        return task_queue, process
+
+    def worker_for(self, client_id):
+        return zlib.crc32(client_id.encode()) % self.num_workers
+
+    def submit(self, client_id, frame, timestamp=None):
+        """Queue frame (LazyFrame or image) for analysis; returns a Future resolving to FrameAnalyzer.analyze()'s result"""
+        codec = "raw"
+        if isinstance(frame, LazyFrame):
+            if frame.decoded or frame.data is None:
+                frame = frame.full()
+            else:
+                # Ship the still-encoded JPEG; the worker decodes only what it needs
+                frame = np.frombuffer(frame.data, dtype=np.uint8)
+                codec = "jpeg"
+        if not isinstance(frame, np.ndarray) or frame.dtype != np.uint8 or frame.size == 0:
+            raise ValueError("Frame is not a non-empty uint8 image or JPEG")
+        if frame.nbytes > self.max_frame_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes exceeds slot size {self.max_frame_bytes}")
+        w = self.worker_for(client_id)
+        try:
+            slot = self._free_slots[w].get(timeout=SLOT_WAIT_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No free inference slot on worker {w}")
+
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._slots[w][slot].buf)
+        view[...] = frame
+        del view
+
+        future = Future()
+        with self._pending_lock:
+            self._task_ids += 1
+            task_id = self._task_ids
+            self._pending[task_id] = (future, w, slot)
+            # Under the lock, so a worker restart either fails this task or hands it to the new worker
+            self._task_queues[w].put(("frame", task_id, client_id, slot, codec, frame.shape,
+                                      timestamp if timestamp is not None else time.time()))
+        return future
+
+    def close_client(self, client_id):
+        """Drop the worker-side state of a disconnected camera"""
+        if self._workers:
+            self._task_queues[self.worker_for(client_id)].put(("close", client_id))
+
+    def replace_identity(self, name, encodings):
+        """Forward a live gallery edit to every worker"""
+        encodings = [np.asarray(e) for e in encodings]
+        with self._pending_lock:
+            self._overrides[name] = encodings
+            for task_queue in self._task_queues:
+                task_queue.put(("gallery", name, encodings))
+
+    def _restart_worker(self, w, process):
+        """Fail the frames a dead worker held, reclaim their slots and fork a replacement"""
+        process.join(timeout=1)
+        print(f"Inference worker {w} died (exit code {process.exitcode}), restarting")
+        task_queue, replacement = self._spawn(w)
+        with self._pending_lock:
+            lost = [(task_id, future, slot) for task_id, (future, worker, slot) in self._pending.items() if worker == w]
+            for task_id, _, _ in lost:
+                del self._pending[task_id]
+            for name, encodings in self._overrides.items():
+                task_queue.put(("gallery", name, encodings))
+            dead_queue = self._task_queues[w]
+            self._task_queues[w] = task_queue
+            self._workers[w] = replacement
+        dead_queue.cancel_join_thread()  # nothing will read what is still queued
+        dead_queue.close()
+        for _, future, slot in lost:
+            self._free_slots[w].put(slot)
+            future.set_exception(RuntimeError(f"inference worker {w} died"))
+        self.restarts += 1
+
+    def _collect_results(self, w, process, reader):
+        """Resolve worker w's futures until its pipe ends, then replace the worker unless shutting down"""
+        while True:
+            try:
+                task_id, faces = reader.recv()
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                future, _, slot = self._pending.pop(task_id, (None, None, None))
+            if future is None:
+                continue
+            self._free_slots[w].put(slot)
+            future.set_result(faces)
+        reader.close()
+        if not self._stopping:
+            try:
+                self._restart_worker(w, process)
+            except Exception as e:
+                print(f"Inference worker {w} restart failed: {e}")
+
+    def shutdown(self):
+        self._stopping = True
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for process in self._workers:
+            process.join(timeout=2)
+        for slots in self._slots:
+            for slot in slots:
+                slot.close()
+                slot.unlink()
+        self._workers = []
@@ -1,15 +1,31 @@
 import asyncio
+import hmac
 import json
 import socket
 import requests
 import websockets
 import cv2
 import numpy as np
-import pickle
+import os
 import time
 import threading
-import queue
-import face_recognition
+from face_gallery import load_gallery
+from detection_feed import DetectionFeed, parse_filter, sse_message
+from encode_batcher import EncodeBatcher
+from frame_analyzer import FrameAnalyzer
+from frame_codec import LazyFrame, is_jpeg
+from frame_envelope import FLAG_JPEG, MAX_CHANNEL, MUX_VERSION, SequenceTracker, hello_options, parse_hello, unpack_channel, unpack_frame
+from mux_channel import MuxChannel
+from session_manager import SessionManager
+from mjpeg_pull import MJPEGPuller
+from mosaic import MOSAIC_FPS, MosaicManager
+from rate_controller import CONTROL_INTERVAL, RateController
+from shard_router import SHARDS_FILE, WATCH_INTERVAL, load_shards
+from stream_server import EVENT_KEEPALIVE, LoopSignal, StreamServer, part
+from urllib.parse import parse_qs, urlsplit
+from inference_pool import InferencePool
+from gallery_store import GalleryStore, encode_image_bytes, sync_criminals
+from functools import lru_cache
 from flask import Flask, Response, jsonify, request
 from threading import Lock
 from firebase_admin import credentials, firestore, messaging
@@ -18,9 +34,25 @@ from google.oauth2 import service_account
 from google.auth.transport.requests import Request as GoogleRequest
 
 # Configuration
-ENCODINGS_FILE = "face_encodings.pkl"
 PRINT_COOLDOWN = 5 * 60  # 5 minutes in seconds
 PROJECT_ID = "garud-21e17"
+ADMIN_TOKEN = os.environ.get("GARUD_ADMIN_TOKEN")  # required by /admin routes, which are off without it
+INFERENCE_WORKERS = int(os.environ.get("GARUD_INFERENCE_WORKERS", os.cpu_count() or 1))  # 0 = in-process
+INFERENCE_TIMEOUT = 5  # seconds
+LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag probes
+LOOP_LAG_REPORT = 60  # seconds between loop lag summaries
+MAX_FRAME_AGE = 1.0  # seconds since capture after which a frame is dropped as late
+VIEWER_QUALITY = 70  # JPEG quality of the annotated /video_feed stream
+# When /video_feed forwards the camera's own JPEG instead of drawing on it and re-encoding:
+# "auto" for frames without faces, "all" for every frame, "off" never; boxes and names
+# always go out on /annotations/<client_id> for viewers to draw themselves
+PASSTHROUGH = os.environ.get("GARUD_PASSTHROUGH", "auto")
+# Cameras pulled over MJPEG instead of pushing over websocket: "id=http://cam:81/stream,id2=..."
+MJPEG_CAMERAS = dict(entry.split("=", 1) for entry in os.environ.get("GARUD_MJPEG_CAMERAS", "").split(",") if "=" in entry)
+WS_PORT = int(os.environ.get("GARUD_WS_PORT", 8888))
+HTTP_PORT = int(os.environ.get("GARUD_HTTP_PORT", 5000))
+STREAM_PORT = int(os.environ.get("GARUD_STREAM_PORT", 0))  # asyncio viewer server for /video_feed; 0 = off
+SHARD_NAME = os.environ.get("GARUD_SHARD")  # set when running as a backend behind shard_router.py
 
 # Initialize Firebase only once
 credentials = service_account.Credentials.from_service_account_file(
@@ -34,142 +66,88 @@ credentials = service_account.Credentials.from_service_account_file(
 # Setup Firestore client
 db = firestore.Client(credentials=credentials, project=PROJECT_ID)
 
-# Load face encodings
-with open(ENCODINGS_FILE, "rb") as f:
-    data = pickle.load(f)
-    known_face_encodings = np.array(data["encodings"])
-    known_face_names = data["names"]
+# Load face encodings; the store swaps in updated galleries while running
+gallery_store = GalleryStore(load_gallery())
 
 # Global state
-clients = {}
-clients_lock = Lock()
 last_print_times = {}
 print_times_lock = Lock()
 running = True
+inference_pool = None  # started in __main__ when INFERENCE_WORKERS > 0
+encode_batcher = None  # shared by in-process analyzers otherwise
+loop_lag = {"current": 0.0, "avg": 0.0, "max": 0.0}  # seconds the websocket loop woke up late
+stream_server = None  # asyncio viewer server, when STREAM_PORT is set
+detection_feed = DetectionFeed()  # who was seen where and when, for /events subscribers
 
 app = Flask(__name__)
 
-def process_frames(input_queue, output_queue, client_id):
-    global running, known_face_encodings, known_face_names
+def process_frames(session):
+    global running
+    client_id = session.client_id
+    frame_slot = session.frame_slot
+    hub = session.hub
+    stats = session.stats
     frame_count = 0
-    recognized_names = []
-    prev_num_faces = 0
+    had_faces = False
+    analyzer = FrameAnalyzer(gallery_store, encode_batcher) if inference_pool is None else None
+    in_flight = None  # this camera's frame in the worker pool, kept past a timeout until it resolves
 
     print(f"Processor started for {client_id}")
-    try:
-        # Fetch UID from garudIDMap
-        doc_ref = db.collection("garudIdMap").document(client_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            client_uid = doc.to_dict().get("uid")
-            user_doc = db.collection("users").document(client_uid).get()
-            user_doc = user_doc.to_dict()
-            fcm_token = user_doc.get("token")
-            client_name = user_doc.get("name")
-            client_gairdians = user_doc.get("guardians", [])
-        else:
-            print(f"No UID mapping found for client_id {client_id}")
-            fcm_token = None
-        print(f"UID: {client_uid}, FCM Token: {fcm_token}")
-    except Exception as e:
-        print(f"Error retrieving UID/FCM token: {e}")
-        fcm_token = None
+    # The processor starts once per session; resumed sessions keep the owner resolved here
+    if session.owner is None:
+        session.owner = resolve_owner(client_id)
+    owner = session.owner
+    client_uid = owner['uid']
+    fcm_token = owner['token']
+    client_name = owner['name']
+    client_gairdians = owner['guardians']
 
     try:
         while running:
             # Check client status
-            with clients_lock:
-                if client_id not in clients or not clients[client_id]['running']:
-                    print(f"Processor stopping: client {client_id} not active")
-                    break
-
-            try:
-                frame = input_queue.get(timeout=0.5)
-                if frame is None or frame.size == 0:
-                    continue
-            except queue.Empty:
-                continue
+            if not session.running:
+                print(f"Processor stopping: client {client_id} not active")
+                break
 
-            # Validate frame properties
-            if frame.dtype != np.uint8:
-                print(f"Invalid frame dtype: {frame.dtype}")
+            # Only the newest frame is taken and decoded; older ones were overwritten in the slot
+            item = frame_slot.get(timeout=0.5)
+            if item is None:
                 continue
-                
-            if frame.ndim not in (2, 3):
-                print(f"Invalid frame dimensions: {frame.ndim}")
-                continue
-
+            data, captured_at = item
             current_time = time.time()
-
-            # Robust color conversion
-            try:
-                if frame.ndim == 2:  # Grayscale
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-                elif frame.shape[2] == 4:  # BGRA format
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB)
-                else:  # Assume BGR
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            except Exception as e:
-                print(f"Frame conversion error: {e}")
+            if current_time - captured_at > MAX_FRAME_AGE:
+                stats['late'] += 1
                 continue
+            frame = LazyFrame.from_jpeg(data)
 
-            # Create resized copy for face detection
+            # Detection and recognition run in the worker pool when it is enabled
             try:
-                small_rgb_frame = cv2.resize(rgb_frame, (0, 0), fx=0.25, fy=0.25)
-                if small_rgb_frame.size == 0:
-                    print("Resized frame is empty")
-                    continue
+                if inference_pool is not None:
+                    # The worker analyses a camera's frames with one FrameAnalyzer, which must not run twice at once
+                    if in_flight is not None and not in_flight.done():
+                        stats['late'] += 1
+                        continue
+                    in_flight = inference_pool.submit(client_id, frame, current_time)
+                    faces = in_flight.result(timeout=INFERENCE_TIMEOUT)
+                else:
+                    faces = analyzer.analyze(frame, current_time)
             except Exception as e:
-                print(f"Resize error: {e}")
+                print(f"Inference error for {client_id}: {e}")
                 continue
+            if faces is None:
+                continue
+            # Glass-to-result latency, true glass-to-glass for clients that stamp capture time
+            stats['latency'] = 0.9 * stats['latency'] + 0.1 * (time.time() - captured_at)
+            stats['processed'] += 1
 
-            # Face detection
-            try:
-                face_locations_small = face_recognition.face_locations(small_rgb_frame, model="hog")
-                current_face_locations = [(top*4, right*4, bottom*4, left*4)
-                                        for (top, right, bottom, left) in face_locations_small]
-            except Exception as e:
-                print(f"Face location error: {e}")
-                current_face_locations = []
-                
-            num_faces = len(current_face_locations)
-            force_encode = num_faces != prev_num_faces
-            prev_num_faces = num_faces
-
-            # Face recognition
-            if frame_count % 10 == 0 or force_encode:
-                current_face_encodings = []
-                if current_face_locations:
-                    try:
-                        current_face_encodings = face_recognition.face_encodings(
-                            rgb_frame, current_face_locations, model="small"
-                        )
-                    except Exception as e:
-                        print(f"Encoding error: {e}")
-                        current_face_encodings = []
-
-                current_names = []
-                for encoding in current_face_encodings:
-                    if encoding.size == 0:
-                        current_names.append("Unknown")
-                        continue
-                    try:
-                        dists = np.linalg.norm(known_face_encodings - encoding, axis=1)
-                        matches = dists <= 0.5
-                        if np.any(matches):
-                            first_match_index = np.argmin(dists)
-                            name = known_face_names[first_match_index]
-                        else:
-                            name = "Unknown"
-                    except Exception as e:
-                        print(f"Recognition error: {e}")
-                        name = "Unknown"
-                    current_names.append(name)
-                recognized_names = current_names
-
-            # Draw annotations
-            names = recognized_names if len(recognized_names) >= len(current_face_locations) else ["Unknown"]*len(current_face_locations)
-            for (top, right, bottom, left), name in zip(current_face_locations, names):
+            # Detection events for metadata subscribers; the first frame without faces ends a sighting
+            if detection_feed.active and (faces or had_faces):
+                detection_feed.publish({"client_id": client_id, "seq": stats['processed'], "captured_at": captured_at,
+                                        "processed_at": time.time(), "faces": face_records(faces)})
+            had_faces = bool(faces)
+
+            # Notify on known faces
+            for _, name, _ in faces:
                 if name != "Unknown":
                     with print_times_lock:
                         last_time = last_print_times.get(name, 0)
@@ -179,29 +157,77 @@ def process_frames(input_queue, output_queue, client_id):
 
                             if fcm_token:
                                 handle_known_face_detection(name, fcm_token, client_uid, client_id, client_name, client_gairdians)  
-                                
+
+            frame_count += 1
+
+            # Nothing below is needed unless someone is watching
+            if not session.viewers:
+                continue
+            annotations = {"captured_at": captured_at, "faces": face_records(faces)}
+            if PASSTHROUGH == "all" or (PASSTHROUGH == "auto" and not faces) \
+                    or session.passthrough_viewers == session.viewers:
+                # Nothing worth drawing, or nobody who needs it drawn: forward the camera's JPEG, no decode or encode
+                hub.publish(bytes(data), {**annotations, "drawn": False})
+                continue
+
+            # The full-resolution decode is only needed to draw on the frame
+            image = frame.full()
+            if image is None:
+                print(f"Invalid frame from {client_id}")
+                continue
+
+            for (top, right, bottom, left), name, _ in faces:
                 color = (0, 255, 0) if name.endswith("G") else (0, 0, 255) if name != "Unknown" else (0, 255, 255)
-                cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                cv2.rectangle(image, (left, top), (right, bottom), color, 2)
+                cv2.putText(image, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
             # Add client ID watermark
-            cv2.putText(frame, client_id[:8], (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            cv2.putText(image, client_id[:8], (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
 
-            try:
-                if not output_queue.full():
-                    output_queue.put(frame)
-            except:
-                pass  # Queue might be closed
-            frame_count += 1
+            # Encoded once here, however many viewers are watching
+            ret, jpeg = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), VIEWER_QUALITY])
+            if ret:
+                hub.publish(jpeg.tobytes(), {**annotations, "drawn": True})
 
     except Exception as e:
         print(f"Processor error for {client_id}: {str(e)}")
     finally:
         print(f"Closing processor for {client_id}")
-        try:
-            output_queue.put(None, block=False)
-        except:
-            pass
+        if inference_pool is not None:
+            inference_pool.close_client(client_id)
+        hub.close()
+
+def face_records(faces):
+    """JSON-ready boxes, names and gallery distances of analyze() results"""
+    return [{"box": [int(top), int(right), int(bottom), int(left)], "name": name,
+             "distance": round(distance, 4) if distance is not None else None}
+            for (top, right, bottom, left), name, distance in faces]
+
+# Sessions outlive their connections for a grace period; see session_manager.py
+sessions = SessionManager(process_frames)
+mosaics = MosaicManager(sessions.sessions)
+pullers = {}  # client_id -> pull_camera task of each MJPEG camera this server pulls
+
+def resolve_owner(client_id):
+    """User and guardian info for a camera from garudIdMap and users"""
+    owner = {'uid': None, 'token': None, 'name': None, 'guardians': []}
+    try:
+        # Fetch UID from garudIDMap
+        doc_ref = db.collection("garudIdMap").document(client_id)
+        doc = doc_ref.get()
+        if doc.exists:
+            owner['uid'] = doc.to_dict().get("uid")
+            user_doc = db.collection("users").document(owner['uid']).get()
+            user_doc = user_doc.to_dict()
+            owner['token'] = user_doc.get("token")
+            owner['name'] = user_doc.get("name")
+            owner['guardians'] = user_doc.get("guardians", [])
+        else:
+            print(f"No UID mapping found for client_id {client_id}")
+        print(f"UID: {owner['uid']}, FCM Token: {owner['token']}")
+    except Exception as e:
+        print(f"Error retrieving UID/FCM token: {e}")
+    return owner
 
 def handle_known_face_detection(criminal_name: str, fcm_token: str, client_uid: str, client_id: str, client_name: str, client_gaurdians: list):
     try:
@@ -332,54 +358,53 @@ def send_notification(fcm_token, client_name, detectedData, mode):
         print(f"Notification send error: {e}")
         return 500, str(e)
 
-def generate_video(client_id):
+@lru_cache(maxsize=256)
+def waiting_frame(client_id):
+    """Keep-alive image for a stream whose camera sends nothing, encoded once per client"""
+    gray_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.putText(gray_frame, f"Waiting for {client_id[:8]}...", (160, 220), 
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    cv2.putText(gray_frame, "No frames received", (180, 260), 
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (150, 150, 150), 1)
+    ret, jpeg = cv2.imencode('.jpg', gray_frame)
+    return jpeg.tobytes() if ret else None
+
+def generate_video(session):
+    client_id = session.client_id
+    hub = session.hub
     print(f"Starting video feed for {client_id}")
     frame_timeout = 10  # seconds
     last_frame_time = time.time()
+    cursor = 0  # seq of the last frame sent to this viewer; other viewers read the same frames
     
     while True:
         try:
-            # Check if client still exists and is running
-            with clients_lock:
-                client_data = clients.get(client_id)
-                if not client_data or not client_data['running']:
-                    print(f"Client {client_id} not found or not running, stopping video feed")
-                    break
-                output_queue = client_data['output_queue']
+            # Check if client is still running
+            if not session.running:
+                print(f"Client {client_id} not running, stopping video feed")
+                break
 
-            try:
-                frame = output_queue.get(timeout=1)
-                current_time = time.time()
-                
-                if frame is None:
-                    print(f"Received None frame for {client_id}, ending stream")
-                    break
-                    
-                last_frame_time = current_time
-                
-                # Encode and yield frame
-                ret, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                if ret:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
-                
-            except queue.Empty:
-                # Check if we've been waiting too long for frames
-                if time.time() - last_frame_time > frame_timeout:
-                    print(f"No frames received for {client_id} in {frame_timeout} seconds")
-                    break
-                    
-                # Send keep-alive frame
-                gray_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(gray_frame, f"Waiting for {client_id[:8]}...", (160, 220), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                cv2.putText(gray_frame, "No frames received", (180, 260), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (150, 150, 150), 1)
-                
-                ret, jpeg = cv2.imencode('.jpg', gray_frame)
-                if ret:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
+            frame = hub.read(cursor, timeout=1)
+            if frame is not None:
+                cursor, jpeg, _ = frame
+                last_frame_time = time.time()
+                # X-Frame-Seq matches the frame to its /annotations event
+                yield part(jpeg, cursor)
+                continue
+
+            if hub.closed:
+                print(f"Stream closed for {client_id}, ending stream")
+                break
+
+            # Check if we've been waiting too long for frames
+            if time.time() - last_frame_time > frame_timeout:
+                print(f"No frames received for {client_id} in {frame_timeout} seconds")
+                break
+
+            # Send keep-alive frame
+            jpeg = waiting_frame(client_id)
+            if jpeg:
+                yield part(jpeg)
                 
         except Exception as e:
             print(f"Stream error for {client_id}: {str(e)}")
@@ -387,6 +412,30 @@ def generate_video(client_id):
     
     print(f"Video feed ended for {client_id}")
 
+def generate_annotations(session):
+    """Server-sent events with the boxes and names of each frame published to viewers"""
+    client_id = session.client_id
+    hub = session.hub
+    cursor = 0
+    while session.running:
+        frame = hub.read(cursor, timeout=15)
+        if frame is not None:
+            cursor, _, annotations = frame
+            yield f"id: {cursor}\ndata: {json.dumps(annotations)}\n\n"
+        elif hub.closed:
+            break
+        else:
+            yield ": keep-alive\n\n"
+    print(f"Annotation feed ended for {client_id}")
+
+def count_viewer(session, stream, passthrough=False):
+    """Count a viewer on the session while its stream is open; frames are only annotated when watched"""
+    session.add_viewer(passthrough)
+    try:
+        yield from stream
+    finally:
+        session.remove_viewer(passthrough)
+
 @app.route('/')
 def index():
     return "Hello from Garud"
@@ -394,80 +443,448 @@ def index():
 @app.route('/video_feed/<client_id>')
 def video_feed(client_id):
     # Check if client exists before starting video feed
-    with clients_lock:
-        if client_id not in clients:
-            return f"Client {client_id} not found", 404
+    session = sessions.get(client_id)
+    if session is None:
+        return f"Client {client_id} not found", 404
     
-    return Response(generate_video(client_id), 
+    return Response(count_viewer(session, generate_video(session)), 
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/annotations/<client_id>')
+def annotation_feed(client_id):
+    # Boxes and names for viewers that draw over the passthrough stream themselves
+    session = sessions.get(client_id)
+    if session is None:
+        return f"Client {client_id} not found", 404
+    return Response(count_viewer(session, generate_annotations(session), passthrough=True), mimetype='text/event-stream')
+
+@app.route('/mosaic')
+def mosaic_feed():
+    """Every camera, or ?client_id=a,b, in one grid at ?fps= grids per second, encoded once for all viewers"""
+    try:
+        mosaic = mosaics.get(parse_filter(request.args.getlist('client_id')),
+                             float(request.args.get('fps', MOSAIC_FPS)))
+    except ValueError as e:
+        return str(e), 400
+    return Response(count_viewer(mosaic, generate_video(mosaic)), 
+                   mimetype='multipart/x-mixed-replace; boundary=frame')
+
+def generate_events(subscription):
+    try:
+        while True:
+            event = subscription.get(timeout=EVENT_KEEPALIVE)
+            if event is not None:
+                yield sse_message(event)
+            elif subscription.closed:
+                break
+            else:
+                yield ": keep-alive\n\n"
+    finally:
+        detection_feed.unsubscribe(subscription)
+
+@app.route('/events')
+def detection_events():
+    """Server-sent detection events of every camera, filtered by ?client_id= and ?name= (comma-separated)"""
+    subscription = detection_feed.subscribe(parse_filter(request.args.getlist('client_id')),
+                                            parse_filter(request.args.getlist('name')))
+    return Response(generate_events(subscription), mimetype='text/event-stream')
+
+def ingest_status(session):
+    """Ingest counters and latencies of one client for the status routes"""
+    stats = session.stats
+    return {
+        "source": session.source,
+        "connected": session.connection is not None,
+        "viewers": session.viewers,
+        "viewer_skipped": session.hub.skipped,
+        "received": session.frame_slot.received,
+        "processed": stats['processed'],
+        "overwritten": session.frame_slot.overwritten,
+        "lost": stats['lost'],
+        "reordered": stats['reordered'],
+        "late": stats['late'],
+        "resolution": stats['resolution'],
+        "settings": stats['settings'],
+        "network_latency_ms": round(stats['network_latency'] * 1000, 1),
+        "latency_ms": round(stats['latency'] * 1000, 1)
+    }
+
+@app.route('/status')
+def server_status():
+    """Event loop lag and per-client ingest counters"""
+    return jsonify({
+        "loop_lag_ms": {k: round(v * 1000, 2) for k, v in loop_lag.items()},
+        "sessions": {**sessions.stats, "setup_delayed": sessions.limiter.delayed},
+        "stream_server": stream_server.stats if stream_server is not None else None,
+        "detection_feed": {**detection_feed.stats, "subscribers": detection_feed.subscribers()},
+        "mosaics": [{"client_ids": sorted(m.client_ids) if m.client_ids else None, "fps": m.fps,
+                     "viewers": m.viewers, **m.stats} for m in mosaics.mosaics()],
+        "clients": {session.client_id: ingest_status(session) for session in sessions.sessions()}
+    })
+
 @app.route('/status/<client_id>')
 def client_status(client_id):
     """Check if a client is connected and active"""
-    with clients_lock:
-        if client_id in clients and clients[client_id]['running']:
-            return jsonify({"status": "active", "client_id": client_id})
-        else:
-            return jsonify({"status": "inactive", "client_id": client_id}), 404
-
-def cleanup_client(client_id):
-    """Properly cleanup client resources"""
-    print(f"Starting cleanup for {client_id}")
-    with clients_lock:
-        if client_id in clients:
-            client_data = clients[client_id]
-            client_data['running'] = False
-            
-            # Clear input queue
-            while not client_data['input_queue'].empty():
-                try:
-                    client_data['input_queue'].get_nowait()
-                except queue.Empty:
+    session = sessions.get(client_id)
+    if session is not None and session.running:
+        return jsonify({"status": "active", "client_id": client_id, **ingest_status(session)})
+    else:
+        return jsonify({"status": "inactive", "client_id": client_id}), 404
+
+def admin_denied():
+    """The error response for a request /admin must refuse, or None; closed unless GARUD_ADMIN_TOKEN is set"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "admin API disabled, set GARUD_ADMIN_TOKEN to enable it"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "unauthorized"}), 401
+    return None
+
+@app.route('/admin/gallery', methods=['GET'])
+def gallery_info():
+    denied = admin_denied()
+    if denied:
+        return denied
+    gallery = gallery_store.gallery
+    return jsonify({"version": gallery_store.version, "encodings": len(gallery),
+                    "identities": len(gallery.identities()), "indexed": gallery.index is not None})
+
+@app.route('/admin/gallery/reload', methods=['POST'])
+def gallery_reload():
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        gallery_store.reload()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"version": gallery_store.version, "encodings": len(gallery_store.gallery)})
+
+@app.route('/admin/gallery/<name>', methods=['PUT', 'DELETE'])
+def gallery_identity(name):
+    """Enroll (PUT with one or more `image` files) or remove (DELETE) an identity"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'DELETE':
+        gallery_store.remove(name)
+        return jsonify({"version": gallery_store.version, "name": name, "encodings": 0})
+
+    images = request.files.getlist("image")
+    if not images:
+        return jsonify({"error": "no image uploaded"}), 400
+    encodings = [e for e in (encode_image_bytes(img.read()) for img in images) if e is not None]
+    if not encodings:
+        return jsonify({"error": "no face found"}), 422
+    gallery_store.replace(name, encodings)
+    return jsonify({"version": gallery_store.version, "name": name, "encodings": len(encodings)})
+
+async def pull_camera(client_id, url):
+    """Feed an ESP32 CameraWebServer MJPEG stream into the same pipeline as a websocket camera"""
+    session = None
+    restarting = None
+
+    async def restart():
+        nonlocal session
+        session, _ = await sessions.attach(client_id, "mjpeg", puller)
+        print(f"Session restarted for pulled camera {client_id}")
+
+    def on_frame(data, captured_at):
+        nonlocal restarting
+        if session.running:
+            session.put_frame(data, captured_at)
+        elif restarting is None or restarting.done():
+            # The reaper ended the session (camera offline past the idle timeout, or its processor died);
+            # the puller outlives it, so start a new one and drop frames until it is attached
+            restarting = asyncio.create_task(restart())
+
+    puller = MJPEGPuller(client_id, url, on_frame)
+    session, _ = await sessions.attach(client_id, "mjpeg", puller)
+    try:
+        await puller.run()
+    finally:
+        puller.stop()
+        if restarting is not None:
+            restarting.cancel()
+        sessions.detach(session, puller)
+
+async def control_camera(websocket, session, max_resolution=None, channel=None):
+    """Tell a camera the frame rate, resolution and quality its processor can actually use"""
+    controller = RateController(max_resolution) if max_resolution else RateController()
+    frame_slot = session.frame_slot
+    stats = session.stats
+    last = (frame_slot.received, stats['processed'], frame_slot.overwritten)
+    settings = controller.settings()
+    while session.running:
+        stats['settings'] = settings
+        message = {"type": "control", **settings}
+        if channel is not None:
+            message["channel"] = channel  # a camera behind a gateway
+        try:
+            await websocket.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            break
+        settings = None
+        while settings is None and session.running:
+            await asyncio.sleep(CONTROL_INTERVAL)
+            current = (frame_slot.received, stats['processed'], frame_slot.overwritten)
+            received, processed, overwritten = (c - l for c, l in zip(current, last))
+            last = current
+            # Only enveloped frames carry the capture time needed for network latency
+            network_latency = stats['network_latency'] if stats['resolution'] else None
+            settings = controller.update(received, processed, overwritten, CONTROL_INTERVAL, network_latency)
+
+def accept_frame(session, message, envelope, sequence):
+    """Check an incoming frame and record its stats; returns (jpeg, capture time), or None to drop it"""
+    stats = session.stats
+    client_id = session.client_id
+
+    # Validate frame data
+    if len(message) < 100:  # Minimum valid frame size
+        print(f"Received suspiciously small frame ({len(message)} bytes)")
+        return None
+
+    received_at = time.time()
+    captured_at = received_at
+    if envelope:
+        header, message = unpack_frame(message)
+        if not header['flags'] & FLAG_JPEG:
+            print(f"Unsupported codec flags {header['flags']:#x} from {client_id}")
+            return None
+        if not sequence.update(header['seq']):
+            stats['reordered'] = sequence.reordered
+            return None
+        stats['lost'] = sequence.lost
+        stats['resolution'] = (header['width'], header['height'])
+        captured_at = sequence.captured_at(header['captured_at'], received_at)
+        stats['network_latency'] = 0.9 * stats['network_latency'] + 0.1 * (received_at - captured_at)
+        # Already too old to be worth processing
+        if received_at - captured_at > MAX_FRAME_AGE:
+            stats['late'] += 1
+            return None
+
+    # Decoding is deferred to the processor, which decodes only the frames it takes
+    if not is_jpeg(message):
+        print(f"Invalid frame from {client_id}")
+        return None
+    return message, captured_at
+
+async def handle_gateway(websocket, gateway_id):
+    """Serve a gateway's multiplexed connection: one channel per camera, each with its own session"""
+    loop = asyncio.get_running_loop()
+    channels = {}  # channel number -> MuxChannel
+    credits = {}   # channel number -> frames to credit back in the next credit message
+    credit_ready = asyncio.Event()
+    opening = set()  # keep references so the tasks are not collected
+    source = f"gateway {gateway_id}"
+
+    def release(channel):
+        if channels.get(channel.channel) is channel:
+            granted = channel.refill()
+            if granted:
+                credits[channel.channel] = credits.get(channel.channel, 0) + granted
+                credit_ready.set()
+
+    def released_by_processor(channel):
+        loop.call_soon_threadsafe(release, channel)
+
+    async def send_close(number):
+        try:
+            await websocket.send(json.dumps({"type": "close", "channel": number}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def session_stopped(channel):
+        # Its processor takes no more frames, so no credit would ever come back: close the channel
+        if channels.get(channel.channel) is channel:
+            print(f"Channel {channel.channel} of {gateway_id} closed: session of {channel.client_id} ended")
+            close_channel(channel.channel)
+            task = asyncio.create_task(send_close(channel.channel))
+            opening.add(task)
+            task.add_done_callback(opening.discard)
+
+    def stopped_by_session(channel):
+        try:
+            loop.call_soon_threadsafe(session_stopped, channel)
+        except RuntimeError:
+            pass  # loop already closed at shutdown
+
+    async def send_credits():
+        # One message credits every channel released since the last, however many cameras
+        while True:
+            await credit_ready.wait()
+            credit_ready.clear()
+            batch = dict(credits)
+            credits.clear()
+            await websocket.send(json.dumps({"type": "credit", "credits": batch}))
+
+    async def open_channel(number, client_id, options):
+        channel = MuxChannel(number, client_id, options)
+        channels[number] = channel
+        try:
+            session, resumed = await sessions.attach(client_id, source, channel)
+            if channels.get(number) is not channel:
+                sessions.detach(session, channel)  # closed while waiting for setup
+                return
+            channel.bind(session, released_by_processor, stopped_by_session)
+            await websocket.send(json.dumps({"type": "opened", "channel": number, "envelope": options['envelope'],
+                                             "control": options['control'], "credit": channel.credit}))
+            print(f"Gateway {gateway_id} opened channel {number} for {client_id}{' (resumed)' if resumed else ''}")
+            if options['control']:
+                channel.control_task = asyncio.create_task(
+                    control_camera(websocket, session, options['max_resolution'], number))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def close_channel(number):
+        channel = channels.pop(number, None)
+        if channel is None:
+            return
+        if channel.control_task is not None:
+            channel.control_task.cancel()
+        channel.unbind()
+        if channel.session is not None:
+            sessions.detach(channel.session, channel)
+
+    sender = asyncio.create_task(send_credits())
+    try:
+        await websocket.send(json.dumps({"status": "REGISTRATION_SUCCESS", "mux": MUX_VERSION}))
+        print(f"Gateway registered successfully: {gateway_id}")
+
+        while True:
+            message = await websocket.recv()
+            if isinstance(message, str):
+                if message == "PING":
+                    await websocket.send("PONG")
+                elif message == "DISCONNECT":
+                    print(f"Gateway {gateway_id} requested disconnect")
                     break
-            
-            # Signal output queue to stop
+                elif message.startswith("{"):
+                    number = None
+                    try:
+                        request = json.loads(message)
+                        number = request.get("channel")
+                        options = hello_options(request) if request.get("type") == "open" else None
+                    except (ValueError, TypeError) as e:
+                        # A malformed message fails on its own; the gateway's other channels carry on
+                        await websocket.send(json.dumps({"type": "error", "channel": number,
+                                                         "error": f"invalid message: {e}"}))
+                        continue
+                    if request.get("type") == "open":
+                        if (not isinstance(number, int) or not 0 <= number <= MAX_CHANNEL
+                                or number in channels or not isinstance(request.get("client_id"), str)
+                                or not request["client_id"]):
+                            await websocket.send(json.dumps({"type": "error", "channel": number,
+                                                             "error": "invalid or busy channel"}))
+                            continue
+                        task = asyncio.create_task(open_channel(number, request["client_id"], options))
+                        opening.add(task)
+                        task.add_done_callback(opening.discard)
+                    elif request.get("type") == "close" and isinstance(number, int):
+                        close_channel(number)
+                continue
+
             try:
-                client_data['output_queue'].put(None, block=False)
-            except queue.Full:
-                pass
-            
-            # Wait a bit for thread to finish
-            if 'thread' in client_data and client_data['thread'].is_alive():
-                client_data['thread'].join(timeout=2)
-            
-            del clients[client_id]
-            print(f"Cleanup completed for {client_id}")
+                number, payload = unpack_channel(message)
+            except ValueError as e:
+                print(f"Frame processing error: {str(e)}")
+                continue
+            channel = channels.get(number)
+            # Unknown, still opening, or sent without credit: the gateway is not owed this frame back
+            if channel is None or not channel.spend():
+                continue
+            session = channel.session
+            try:
+                frame = accept_frame(session, payload, channel.options['envelope'], channel.sequence)
+            except Exception as e:
+                print(f"Frame processing error: {str(e)}")
+                frame = None
+            if frame is None:
+                channel.drop()
+                release(channel)
+                continue
+
+            # A direct connection of the same camera takes its session over from the channel
+            if not session.running or session.connection is not channel:
+                print(f"Channel {number} of {gateway_id} replaced or session ended")
+                close_channel(number)
+                await websocket.send(json.dumps({"type": "close", "channel": number}))
+                continue
+
+            session.put_frame(*frame)
+    finally:
+        sender.cancel()
+        for number in list(channels):
+            close_channel(number)
+
+async def handle_event_subscriber(websocket, query):
+    """Push detection events to a websocket as JSON text messages.
+
+    The filter comes from the ?client_id= and ?name= query and is replaced by
+    any {"client_id": [...], "name": [...]} message the subscriber sends.
+    """
+    subscription = detection_feed.subscribe(parse_filter(query.get('client_id', [])),
+                                            parse_filter(query.get('name', [])))
+    signal = LoopSignal(subscription, asyncio.get_running_loop())
+
+    async def receive_filters():
+        try:
+            async for message in websocket:
+                if isinstance(message, str) and message.startswith("{"):
+                    update = json.loads(message)
+                    subscription.client_ids = parse_filter(update.get('client_id', []))
+                    subscription.names = parse_filter(update.get('name', []))
+        except (websockets.exceptions.ConnectionClosed, ValueError):
+            pass
+        finally:
+            subscription.close()  # wakes the sender below
+
+    receiver = asyncio.create_task(receive_filters())
+    try:
+        while not subscription.closed:
+            event = subscription.get(timeout=0)
+            if event is not None:
+                await websocket.send(json.dumps(event))
+            else:
+                await signal.wait(EVENT_KEEPALIVE)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        receiver.cancel()
+        signal.detach()
+        detection_feed.unsubscribe(subscription)
 
 async def handle_websocket(websocket):
+    # Detection event subscribers connect to /events; cameras and gateways to any other path
+    target = urlsplit(websocket.request.path)
+    if target.path == "/events":
+        await handle_event_subscriber(websocket, parse_qs(target.query))
+        return
+
     client_id = None
+    session = None
+    control_task = None
     try:
-        client_id = await websocket.recv()
+        # A bare client_id, or a JSON hello negotiating the frame envelope and control channel
+        client_id, options = parse_hello(await websocket.recv())
+        envelope = options['envelope']
+        if options['mux']:
+            await handle_gateway(websocket, client_id)
+            return
         print(f"New connection attempt from {client_id}")
         
-        # Clean up any existing connection with same ID
-        cleanup_client(client_id)
-        
-        input_queue = queue.Queue(maxsize=5)
-        output_queue = queue.Queue(maxsize=5)
-
-        processing_thread = threading.Thread(
-            target=process_frames,
-            args=(input_queue, output_queue, client_id),
-            daemon=True
-        )
-        processing_thread.start()
-
-        with clients_lock:
-            clients[client_id] = {
-                'input_queue': input_queue,
-                'output_queue': output_queue,
-                'running': True,
-                'thread': processing_thread,
-                'websocket': websocket
-            }
+        # Resumes the session of an earlier connection with same ID, or starts one (rate limited)
+        session, resumed = await sessions.attach(client_id, "websocket", websocket)
+        sequence = SequenceTracker()
 
-        await websocket.send("REGISTRATION_SUCCESS")
-        print(f"Client registered successfully: {client_id}")
+        if envelope or options['control']:
+            await websocket.send(json.dumps({"status": "REGISTRATION_SUCCESS", "envelope": envelope,
+                                             "control": options['control']}))
+        else:
+            await websocket.send("REGISTRATION_SUCCESS")
+        print(f"Client registered successfully: {client_id} ({'envelope v%d' % envelope if envelope else 'bare JPEG'}"
+              f"{', rate control' if options['control'] else ''}{', resumed' if resumed else ''})")
+        if options['control']:
+            control_task = asyncio.create_task(control_camera(websocket, session, options['max_resolution']))
 
         while True:
             message = await websocket.recv()
@@ -479,29 +896,18 @@ async def handle_websocket(websocket):
                     break
                 continue
 
-            # Validate frame data
-            if len(message) < 100:  # Minimum valid frame size
-                print(f"Received suspiciously small frame ({len(message)} bytes)")
-                continue
-
             try:
-                np_array = np.frombuffer(message, dtype=np.uint8)
-                frame = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-                
-                if frame is None or frame.size == 0:
-                    print(f"Invalid frame from {client_id}")
+                frame = accept_frame(session, message, envelope, sequence)
+                if frame is None:
                     continue
-                    
-                # Check if client is still active
-                with clients_lock:
-                    if client_id not in clients or not clients[client_id]['running']:
-                        break
-                        
-                try:
-                    if not input_queue.full():
-                        input_queue.put(frame, block=False)
-                except queue.Full:
-                    pass  # Skip frame if queue is full
+
+                # Check if client is still active and not taken over by a newer connection
+                if not session.running or session.connection is not websocket:
+                    print(f"Connection of {client_id} replaced or session ended")
+                    break
+
+                # Latest frame wins: a processor that is behind skips frames, it never stalls the loop
+                session.put_frame(*frame)
             except Exception as e:
                 print(f"Frame processing error: {str(e)}")
 
@@ -510,28 +916,111 @@ async def handle_websocket(websocket):
     except Exception as e:
         print(f"WebSocket error for {client_id}: {str(e)}")
     finally:
-        if client_id:
-            cleanup_client(client_id)
+        if control_task is not None:
+            control_task.cancel()
+        if session is not None:
+            # The session stays warm for its grace period; the reaper ends it if the camera stays away
+            sessions.detach(session, websocket)
+
+def shard_cameras(path):
+    """The MJPEG cameras the ring in the shards file assigns to this shard"""
+    _, ring = load_shards(path)
+    return {cid: url for cid, url in MJPEG_CAMERAS.items() if ring.lookup(cid) == SHARD_NAME}
+
+async def sync_pullers(cameras):
+    """Pull exactly cameras: stop the pullers of cameras no longer listed and start the new ones"""
+    for client_id in set(pullers) - set(cameras):
+        task = pullers.pop(client_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Its new shard runs the camera now; end the session here rather than keep it for a reconnect
+        session = sessions.get(client_id)
+        if session is not None and session.connection is None:
+            sessions.end(session)
+        print(f"Stopped pulling {client_id}")
+    for client_id, url in cameras.items():
+        if client_id not in pullers:
+            pullers[client_id] = asyncio.create_task(pull_camera(client_id, url))
+
+async def watch_shard_cameras(path):
+    """Follow shards file changes, as the router does, moving pulled cameras along with the ring"""
+    last = os.stat(path).st_mtime_ns
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            current = os.stat(path).st_mtime_ns
+            if current == last:
+                continue
+            last = current
+            cameras = shard_cameras(path)
+        except Exception as e:
+            print(f"Shards reload error: {e}")
+            continue
+        await sync_pullers(cameras)
+
+async def monitor_loop_lag():
+    """Measure how late the event loop wakes up; any blocking work in a handler shows up here"""
+    loop = asyncio.get_running_loop()
+    last_report = loop.time()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag["current"] = lag
+        loop_lag["avg"] = 0.9 * loop_lag["avg"] + 0.1 * lag
+        loop_lag["max"] = max(loop_lag["max"], lag)
+        if loop.time() - last_report >= LOOP_LAG_REPORT:
+            print(f"Event loop lag: avg {loop_lag['avg'] * 1000:.1f} ms, max {loop_lag['max'] * 1000:.1f} ms")
+            loop_lag["max"] = 0.0
+            last_report = loop.time()
 
 async def main():
+    global stream_server
     local_ip = "0.0.0.0"  # Run on localhost
-    server = await websockets.serve(handle_websocket, local_ip, 8888)
-    print(f"WebSocket server started on ws://{local_ip}:8888")
+    lag_monitor = asyncio.create_task(monitor_loop_lag())  # keep a reference so the task is not collected
+    if STREAM_PORT:
+        # Viewers on the ingest loop: a coroutine each instead of a Flask thread
+        stream_server = StreamServer(sessions.get, ingest_status, waiting_frame, detection_feed, mosaics)
+        await stream_server.start(local_ip, STREAM_PORT)
+        print(f"Stream server started on http://{local_ip}:{STREAM_PORT}")
+    watcher = None
+    if SHARD_NAME:
+        await sync_pullers(shard_cameras(SHARDS_FILE))
+        watcher = asyncio.create_task(watch_shard_cameras(SHARDS_FILE))  # keep a reference so the task is not collected
+    else:
+        await sync_pullers(MJPEG_CAMERAS)
+    server = await websockets.serve(handle_websocket, local_ip, WS_PORT)
+    print(f"WebSocket server started on ws://{local_ip}:{WS_PORT}" + (f" as shard {SHARD_NAME}" if SHARD_NAME else ""))
     await server.wait_closed()
 
 if __name__ == "__main__":
+    # Inference workers run in their own processes, started through a forkserver
+    if INFERENCE_WORKERS > 0:
+        inference_pool = InferencePool(INFERENCE_WORKERS)
+        inference_pool.start()
+        gallery_store.listeners.append(inference_pool.replace_identity)
+    else:
+        encode_batcher = EncodeBatcher(gallery_store)
+
     flask_thread = threading.Thread(
-        target=lambda: app.run(host="0.0.0.0", port=5000, threaded=True, debug=False),
+        target=lambda: app.run(host="0.0.0.0", port=HTTP_PORT, threaded=True, debug=False),
         daemon=True
     )
     flask_thread.start()
 
+    gallery_store.watch()
+    sessions.start_reaper()
+    try:
+        sync_criminals(db, gallery_store)
+    except Exception as e:
+        print(f"Criminal sync unavailable: {e}")
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         running = False
     finally:
         running = False
-        with clients_lock:
-            for cid in list(clients.keys()):
-                cleanup_client(cid)
\ No newline at end of file
+        sessions.close_all()
+        if inference_pool is not None:
+            inference_pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,201 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+RECONNECT_MIN = 1.0         # seconds before the first reconnect attempt
+RECONNECT_MAX = 30.0        # back-off ceiling
+READ_SIZE = 64 * 1024       # bytes per socket read
+READ_TIMEOUT = 10           # seconds without a complete part before the stream is considered dead
+HEADER_LIMIT = 8192         # longest header line accepted
+MAX_PART_BYTES = 2 * 1024 * 1024
+
+
+class StreamError(Exception):
+    """The camera sent something that is not a usable MJPEG stream"""
+
+
+class _BodyReader:
+    """Incremental reader over an HTTP response body.
+
+    Undoes chunked transfer encoding (the ESP32 httpd sends the stream with
+    httpd_resp_send_chunk) and keeps only the bytes not yet consumed.
+    """
+
+    def __init__(self, reader, chunked):
+        self.reader = reader
+        self.chunked = chunked
+        self.buffer = bytearray()
+        self._chunk_left = 0
+
+    async def _fill(self):
+        if self.chunked:
+            if self._chunk_left == 0:
+                line = await self.reader.readuntil(b"\r\n")
+                self._chunk_left = int(line.split(b";")[0].strip(), 16)
+                if self._chunk_left == 0:
+                    raise EOFError("stream ended")
+            data = await self.reader.read(min(self._chunk_left, READ_SIZE))
+            if data:
+                self._chunk_left -= len(data)
+                if self._chunk_left == 0:
+                    await self.reader.readexactly(2)  # CRLF closing the chunk
+        else:
+            data = await self.reader.read(READ_SIZE)
+        if not data:
+            raise EOFError("stream ended")
+        self.buffer += data
+
+    async def readline(self):
+        start = 0
+        while True:
+            end = self.buffer.find(b"\r\n", start)
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                return line
+            if len(self.buffer) > HEADER_LIMIT:
+                raise StreamError("header line too long")
+            start = max(0, len(self.buffer) - 1)
+            await self._fill()
+
+    async def readexactly(self, n):
+        if not self.chunked and len(self.buffer) < n:
+            # Plain body: take the rest of the part straight from the stream
+            data = bytes(self.buffer) + await self.reader.readexactly(n - len(self.buffer))
+            self.buffer.clear()
+            return data
+        while len(self.buffer) < n:
+            await self._fill()
+        with memoryview(self.buffer) as view:
+            data = bytes(view[:n])  # one copy; slicing the bytearray would make a second
+        del self.buffer[:n]
+        return data
+
+
+async def open_stream(url):
+    """GET url and return (reader, writer, body, boundary) for a multipart/x-mixed-replace response"""
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                     f"Accept: multipart/x-mixed-replace\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+        status = await asyncio.wait_for(reader.readuntil(b"\r\n"), READ_TIMEOUT)
+        fields = status.split()
+        if len(fields) < 2 or fields[1] != b"200":
+            raise StreamError(f"unexpected response {status.strip()!r}")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b"\r\n"), READ_TIMEOUT)
+            if line == b"\r\n":
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+    except BaseException:
+        writer.close()
+        raise
+
+    content_type = headers.get("content-type", "")
+    boundary = None
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            boundary = value.strip('"')
+    if not content_type.lower().startswith("multipart/") or not boundary:
+        writer.close()
+        raise StreamError(f"not a multipart stream: {content_type!r}")
+    chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+    return reader, writer, _BodyReader(reader, chunked), boundary.encode()
+
+
+async def read_part(body, boundary):
+    """Read the next part; returns (jpeg bytes, X-Timestamp in seconds or None)"""
+    delimiter = b"--" + boundary
+    while True:
+        line = await body.readline()
+        if line.startswith(delimiter + b"--"):
+            raise EOFError("stream ended")
+        if line.startswith(delimiter):
+            break
+
+    headers = {}
+    while True:
+        line = await body.readline()
+        if not line:
+            break
+        key, _, value = line.partition(b":")
+        headers[key.strip().lower()] = value.strip()
+
+    length = headers.get(b"content-length")
+    if length is None:
+        raise StreamError("part without Content-Length")
+    length = int(length)
+    if length > MAX_PART_BYTES:
+        raise StreamError(f"part of {length} bytes is too large")
+    data = await body.readexactly(length)
+    timestamp = headers.get(b"x-timestamp")
+    return data, float(timestamp) if timestamp else None
+
+
+class MJPEGPuller:
+    """Pulls a CameraWebServer /stream and hands every JPEG to on_frame(data, captured_at).
+
+    The firmware stamps parts with the camera's own clock (time since boot),
+    so captured_at maps it onto server time using the smallest arrival minus
+    camera-time offset seen on the current connection. Latency measured
+    against it is relative to the fastest frame, which absorbs the clock
+    difference but not the fixed network delay. Reconnects back off
+    exponentially with jitter up to RECONNECT_MAX.
+    """
+
+    def __init__(self, client_id, url, on_frame):
+        self.client_id = client_id
+        self.url = url
+        self.on_frame = on_frame
+        self.clock_offset = None
+        self.stats = {"frames": 0, "reconnects": 0, "bytes": 0}
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def captured_at(self, camera_time, now):
+        """Map a camera timestamp onto server time"""
+        offset = now - camera_time
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        return camera_time + self.clock_offset
+
+    async def run(self):
+        delay = RECONNECT_MIN
+        while not self._stopped:
+            writer = None
+            try:
+                reader, writer, body, boundary = await asyncio.wait_for(open_stream(self.url), READ_TIMEOUT)
+                print(f"Pulling MJPEG stream for {self.client_id} from {self.url}")
+                self.clock_offset = None  # the camera may have rebooted
+                while not self._stopped:
+                    data, camera_time = await asyncio.wait_for(read_part(body, boundary), READ_TIMEOUT)
+                    now = time.time()
+                    captured_at = self.captured_at(camera_time, now) if camera_time is not None else now
+                    self.stats["frames"] += 1
+                    self.stats["bytes"] += len(data)
+                    delay = RECONNECT_MIN
+                    self.on_frame(data, captured_at)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, EOFError, ValueError, StreamError, asyncio.TimeoutError, asyncio.LimitOverrunError) as e:
+                print(f"MJPEG stream for {self.client_id} lost: {e!r}")
+            finally:
+                if writer is not None:
+                    writer.close()
+            if self._stopped:
+                break
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, RECONNECT_MAX)
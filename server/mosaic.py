@@ -0,0 +1,217 @@
+import math
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from broadcast_hub import BroadcastHub
+from frame_codec import LazyFrame
+
+MOSAIC_FPS = float(os.environ.get("GARUD_MOSAIC_FPS", 2))  # grids composed per second, unless ?fps= asks otherwise
+MAX_MOSAIC_FPS = 10
+TILE_SIZE = (320, 180)    # width, height of one camera in the grid
+MOSAIC_QUALITY = 70
+REPUBLISH_INTERVAL = 1.0  # seconds after which an unchanged grid is sent again, keeping streams alive
+
+
+def _box_color(name):
+    return (0, 255, 0) if name.endswith("G") else (0, 0, 255) if name != "Unknown" else (0, 255, 255)
+
+
+class Mosaic:
+    """The latest frame of each selected camera in one downscaled grid, shared by its viewers.
+
+    While it has viewers a thread composes the grid fps times a second and
+    publishes it to hub, encoded once for all of them. Tiles are cached per
+    camera and rebuilt only when that camera's hub has a new frame, and a
+    grid in which nothing changed is not encoded again. The mosaic counts as
+    a passthrough viewer of every selected camera, so their processors keep
+    publishing but need not draw and encode for it. It has the session
+    attributes generate_video() and the stream server use.
+    """
+
+    def __init__(self, sessions, client_ids=None, fps=MOSAIC_FPS, tile_size=TILE_SIZE, on_idle=None, on_active=None):
+        self.client_id = "mosaic"
+        self.sessions = sessions      # () -> list of sessions
+        self.client_ids = client_ids  # set, or None for every camera
+        self.fps = fps
+        self.tile_size = tile_size
+        self.on_idle = on_idle        # on_idle(mosaic) once the last viewer left
+        self.on_active = on_active    # on_active(mosaic) when a viewer comes back after on_idle
+        self.hub = BroadcastHub()
+        self.viewers = 0
+        self.stats = {"composed": 0, "encoded": 0, "tiles_rendered": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._idle = False
+        self._tiles = {}    # client_id -> (hub, frame seq, tile)
+        self._scales = {}   # client_id -> JPEG decode scale that still covers a tile
+        self._watched = {}  # client_id -> session this mosaic counts as a viewer of
+        self._layout = None
+        self._jpeg = None
+        self._published_at = 0.0
+
+    @property
+    def running(self):
+        return True
+
+    def add_viewer(self, passthrough=False):
+        with self._lock:
+            self.viewers += 1
+            if self._thread is None:
+                if self._idle and self.on_active is not None:
+                    self.on_active(self)  # a viewer that got this mosaic just before it went idle
+                self._idle = False
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def remove_viewer(self, passthrough=False):
+        with self._lock:
+            self.viewers -= 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self.viewers <= 0:
+                    self._watch([])
+                    self._thread = None
+                    self._idle = True
+                    if self.on_idle is not None:
+                        self.on_idle(self)
+                    return
+            started = time.time()
+            try:
+                self.compose(started)
+            except Exception as e:
+                print(f"Mosaic error: {e}")
+            time.sleep(max(0.0, 1.0 / self.fps - (time.time() - started)))
+
+    def _watch(self, selected):
+        current = {session.client_id: session for session in selected}
+        for client_id, session in list(self._watched.items()):
+            if current.get(client_id) is not session:
+                session.remove_viewer(passthrough=True)
+                del self._watched[client_id]
+        for client_id, session in current.items():
+            if client_id not in self._watched:
+                session.add_viewer(passthrough=True)
+                self._watched[client_id] = session
+
+    def compose(self, now):
+        selected = sorted((s for s in self.sessions() if self.client_ids is None or s.client_id in self.client_ids),
+                          key=lambda s: s.client_id)
+        self._watch(selected)
+        layout = [session.client_id for session in selected]
+        changed = layout != self._layout
+        self._layout = layout
+        for client_id in set(self._tiles) - set(layout):
+            del self._tiles[client_id]
+
+        tiles = []
+        for session in selected:
+            tile, fresh = self._tile(session)
+            changed = changed or fresh
+            tiles.append(tile)
+        self.stats["composed"] += 1
+
+        if changed or self._jpeg is None:
+            ret, jpeg = cv2.imencode('.jpg', self._grid(tiles), [int(cv2.IMWRITE_JPEG_QUALITY), MOSAIC_QUALITY])
+            if not ret:
+                return
+            self._jpeg = jpeg.tobytes()
+            self.stats["encoded"] += 1
+        elif now - self._published_at < REPUBLISH_INTERVAL:
+            return
+        self.hub.publish(self._jpeg)
+        self._published_at = now
+
+    def _tile(self, session):
+        """(tile, rebuilt) for session's newest frame, reusing the cached tile if there is none newer"""
+        hub = session.hub
+        frame = hub.read(0, timeout=0)  # newest frame, without waiting
+        seq = frame[0] if frame is not None else 0
+        cached = self._tiles.get(session.client_id)
+        if cached is not None and cached[0] is hub and cached[1] == seq:
+            return cached[2], False
+        tile = self._render(session.client_id, frame)
+        self._tiles[session.client_id] = (hub, seq, tile)
+        return tile, True
+
+    def _render(self, client_id, frame):
+        width, height = self.tile_size
+        tile = None
+        if frame is not None:
+            _, jpeg, annotations = frame
+            # Decode straight to the smallest size that still covers a tile
+            scale = self._scales.get(client_id, 1)
+            lazy = LazyFrame.from_jpeg(jpeg)
+            image = lazy.reduced(scale) if scale > 1 else lazy.full()
+            if image is not None:
+                full_width, full_height = image.shape[1] * scale, image.shape[0] * scale
+                self._scales[client_id] = max(s for s in (1, 2, 4, 8) if s == 1 or full_width / s >= width)
+                tile = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+                # Passthrough frames carry their boxes as annotations instead of drawn in
+                if annotations and not annotations.get("drawn"):
+                    sx, sy = width / full_width, height / full_height
+                    for face in annotations["faces"]:
+                        top, right, bottom, left = face["box"]
+                        cv2.rectangle(tile, (int(left * sx), int(top * sy)), (int(right * sx), int(bottom * sy)),
+                                      _box_color(face["name"]), 1)
+                self.stats["tiles_rendered"] += 1
+        if tile is None:
+            tile = np.zeros((height, width, 3), dtype=np.uint8)
+            cv2.putText(tile, "No frames", (width // 2 - 45, height // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (150, 150, 150), 1)
+        cv2.putText(tile, client_id[:8], (6, 18), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        return tile
+
+    def _grid(self, tiles):
+        width, height = self.tile_size
+        if not tiles:
+            grid = np.zeros((height, width, 3), dtype=np.uint8)
+            cv2.putText(grid, "No cameras", (width // 2 - 50, height // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (150, 150, 150), 1)
+            return grid
+        columns = math.ceil(math.sqrt(len(tiles)))
+        rows = math.ceil(len(tiles) / columns)
+        grid = np.zeros((rows * height, columns * width, 3), dtype=np.uint8)
+        for i, tile in enumerate(tiles):
+            row, column = divmod(i, columns)
+            grid[row * height:(row + 1) * height, column * width:(column + 1) * width] = tile
+        return grid
+
+
+class MosaicManager:
+    """One Mosaic per camera selection and frame rate, kept while it has viewers"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._mosaics = {}  # (frozenset of client_ids or None, fps) -> Mosaic
+        self._lock = threading.Lock()
+
+    def get(self, client_ids=None, fps=MOSAIC_FPS):
+        """The shared mosaic of client_ids (None for all); raises ValueError for a bad fps"""
+        if not fps > 0:
+            raise ValueError(f"invalid mosaic fps {fps}")
+        fps = min(fps, MAX_MOSAIC_FPS)
+        key = (frozenset(client_ids) if client_ids else None, fps)
+        with self._lock:
+            mosaic = self._mosaics.get(key)
+            if mosaic is None:
+                mosaic = self._mosaics[key] = Mosaic(self.sessions, key[0], fps,
+                                                     on_idle=lambda m: self._forget(key, m),
+                                                     on_active=lambda m: self._register(key, m))
+        return mosaic
+
+    def _register(self, key, mosaic):
+        with self._lock:
+            self._mosaics.setdefault(key, mosaic)
+
+    def _forget(self, key, mosaic):
+        with self._lock:
+            if self._mosaics.get(key) is mosaic:
+                del self._mosaics[key]
+
+    def mosaics(self):
+        with self._lock:
+            return list(self._mosaics.values())
@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+
+MOTION_WIDTH = 160          # pixels; frames are differenced at this width
+BACKGROUND_ALPHA = 0.05     # running-average learning rate
+DIFF_THRESHOLD = 25         # grey-level change that counts as motion
+MIN_AREA = 12               # contour area (at MOTION_WIDTH) ignored as noise
+REGION_PADDING = 24         # pixels around a changed region, in detection-frame coordinates
+FULL_FRAME_FRACTION = 0.5   # changed area above which the whole frame is scanned
+REFRESH_INTERVAL = 2.0      # seconds between unconditional full-frame detections
+
+
+def _merge(boxes):
+    """Union overlapping (top, right, bottom, left) boxes until none overlap"""
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[3] <= b[1] and b[3] <= a[1] and a[0] <= b[2] and b[0] <= a[2]:
+                    boxes[i] = (min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def _inside(box, region):
+    """True if the centre of box lies in region"""
+    cy = (box[0] + box[2]) / 2.0
+    cx = (box[1] + box[3]) / 2.0
+    return region[0] <= cy <= region[2] and region[3] <= cx <= region[1]
+
+
+class MotionGate:
+    """Cheap change detector that decides where face detection has to run.
+
+    regions() compares each detection frame with a running-average background
+    and returns the changed regions, [] for a static scene, or None when the
+    whole frame should be scanned (first frame, large change or periodic
+    refresh).
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.background = None
+        self.last_full = 0.0
+        self.skipped = 0
+
+    def regions(self, image, now):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        height, width = gray.shape
+        scale = min(1.0, MOTION_WIDTH / float(width))
+        tiny = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+        tiny = cv2.GaussianBlur(tiny, (5, 5), 0)
+
+        if self.background is None or self.background.shape != tiny.shape:
+            self.background = tiny.astype(np.float32)
+            self.last_full = now
+            return None
+        diff = cv2.absdiff(tiny, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(tiny, self.background, BACKGROUND_ALPHA)
+
+        if now - self.last_full >= self.refresh_interval:
+            self.last_full = now
+            return None
+
+        _, mask = cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            if cv2.contourArea(contour) < MIN_AREA:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append((max(0, int(y / scale) - REGION_PADDING),
+                          min(width, int((x + w) / scale) + REGION_PADDING),
+                          min(height, int((y + h) / scale) + REGION_PADDING),
+                          max(0, int(x / scale) - REGION_PADDING)))
+        if not boxes:
+            self.skipped += 1
+            return []
+
+        boxes = _merge(boxes)
+        changed = sum((b[2] - b[0]) * (b[1] - b[3]) for b in boxes)
+        if changed >= FULL_FRAME_FRACTION * width * height:
+            self.last_full = now
+            return None
+        return boxes
+
+
+def detect_in_regions(detect, image, regions, previous):
+    """Run detect(image) only where needed.
+
+    regions is the output of MotionGate.regions(): None scans the whole image,
+    [] reuses the previous locations, and otherwise detect runs on each region
+    crop while previous faces outside every changed region are kept.
+    """
+    if regions is None:
+        return detect(image)
+    locations = [box for box in previous if not any(_inside(box, r) for r in regions)]
+    for top, right, bottom, left in regions:
+        crop = np.ascontiguousarray(image[top:bottom, left:right])
+        for (t, r, b, l) in detect(crop):
+            locations.append((t + top, r + left, b + top, l + left))
+    return locations
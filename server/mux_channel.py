@@ -0,0 +1,77 @@
+from frame_envelope import SequenceTracker
+
+MUX_WINDOW = 2  # frames a gateway may have in flight per channel
+
+
+class MuxChannel:
+    """One camera carried on a multiplexed gateway connection.
+
+    Flow control is per channel and credit based: once its session is
+    attached the gateway may send MUX_WINDOW frames, spending one credit per
+    frame, and each frame is credited back when it leaves the server, taken
+    by the processor, overwritten in the slot or dropped on arrival. A camera
+    whose processor falls behind stops being sent frames while the other
+    channels on the connection carry on. A session that stops (reaped, or
+    its processor died) takes no more frames, so the channel is closed then
+    rather than left without credit.
+    """
+    __slots__ = ("channel", "client_id", "options", "session", "sequence", "credit", "window",
+                 "control_task", "_on_take", "_on_close", "_released", "_dropped")
+
+    def __init__(self, channel, client_id, options, window=MUX_WINDOW):
+        self.channel = channel
+        self.client_id = client_id
+        self.options = options
+        self.session = None
+        self.sequence = SequenceTracker()
+        self.credit = 0  # frames the gateway may still send
+        self.window = window
+        self.control_task = None
+        self._on_take = None
+        self._on_close = None
+        self._released = 0  # slot takes and overwrites already credited back
+        self._dropped = 0   # frames dropped before reaching the slot, not yet credited back
+
+    def bind(self, session, on_release, on_stop):
+        """Feed session; on_release(self) is called from its processor thread after every take,
+        on_stop(self) from whichever thread stops the session (at once if it already has)"""
+        slot = session.frame_slot
+        self.session = session
+        self._released = slot.taken + slot.overwritten
+        self.credit = self.window
+        self._on_take = lambda: on_release(self)
+        self._on_close = lambda: on_stop(self)
+        slot.on_take = self._on_take
+        slot.on_close = self._on_close
+        if slot.closed:
+            on_stop(self)
+
+    def unbind(self):
+        if self.session is not None:
+            slot = self.session.frame_slot
+            if slot.on_take is self._on_take:
+                slot.on_take = None
+            if slot.on_close is self._on_close:
+                slot.on_close = None
+        self._on_take = None
+        self._on_close = None
+
+    def spend(self):
+        """Account for an arriving frame; False if the gateway sent it without credit"""
+        if self.session is None or self.credit <= 0:
+            return False
+        self.credit -= 1
+        return True
+
+    def drop(self):
+        self._dropped += 1
+
+    def refill(self):
+        """Credit back the frames released since the last refill; returns how many"""
+        slot = self.session.frame_slot
+        released = slot.taken + slot.overwritten
+        grant = min(released - self._released + self._dropped, self.window - self.credit)
+        self._released = released
+        self._dropped = 0
+        self.credit += grant
+        return grant
@@ -1,36 +1,219 @@
 import face_recognition
+import base64
+import hashlib
+import json
 import os
-import pickle
 import cv2
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ann_index import INDEX_FILE, MIN_INDEX_SIZE, IVFIndex, recall_at_k
+from face_gallery import GALLERY_FILE, FaceGallery, save_gallery
 
 KNOWN_FACES_DIR = "resources"
-ENCODINGS_FILE = "face_encodings.pkl"
+CACHE_FILE = "enrollment_cache.jsonl"    # one JSON record per image, last record wins
+REPORT_FILE = "enrollment_report.json"
+CHECKPOINT_EVERY = 2000                  # new encodings between gallery checkpoints
+CHECKPOINT_INTERVAL = 60                 # or seconds, whichever comes first
+RECALL_QUERIES = 500
+RECALL_NOISE = 0.03  # per-dimension noise, roughly a same-person distance of 0.35
 
-known_face_encodings = []
-known_face_names = []
 
-print("Processing known faces...")
+def encode_image(img_path, previous_sha1=None):
+    """Worker: hash the image and encode its first face unless the content is unchanged"""
+    with open(img_path, "rb") as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    if sha1 == previous_sha1:
+        return {"status": "unchanged", "sha1": sha1}
 
-for filename in os.listdir(KNOWN_FACES_DIR):
-    img_path = os.path.join(KNOWN_FACES_DIR, filename)
-    
-    bgr_img = cv2.imread(img_path)
+    bgr_img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
     if bgr_img is None:
-        print(f"Error reading image: {filename}")
-        continue
+        return {"status": "unreadable", "sha1": sha1}
 
     rgb_img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
-
     encoding = face_recognition.face_encodings(rgb_img)
-    if encoding:
-        known_face_encodings.append(encoding[0])
-        known_face_names.append(os.path.splitext(filename)[0])
-        print(f"Encoded: {filename}")
-    else:
-        print(f"Warning: No face found in {filename}")
+    if not encoding:
+        return {"status": "no_face", "sha1": sha1}
+    return {"status": "ok", "sha1": sha1,
+            "encoding": base64.b64encode(encoding[0].astype(np.float32).tobytes()).decode("ascii")}
+
+
+def init_worker():
+    # One process per core already; keep OpenCV from oversubscribing them
+    cv2.setNumThreads(1)
+
+
+def load_cache(path=CACHE_FILE):
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            records[record["file"]] = record
+    return records
+
+
+def write_cache(records, path=CACHE_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for record in records.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
+
+
+def identity_of(filename):
+    """resources/<name>/<any>.jpg and resources/<name>.jpg both enroll <name>"""
+    head, tail = os.path.split(filename)
+    return head if head else os.path.splitext(tail)[0]
+
+
+def list_images(faces_dir):
+    """Image paths relative to faces_dir, one directory level deep"""
+    for entry in sorted(os.listdir(faces_dir)):
+        path = os.path.join(faces_dir, entry)
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, filename)):
+                    yield os.path.join(entry, filename)
+        elif os.path.isfile(path):
+            yield entry
+
+
+def build_gallery(records):
+    """Group the encoded images by identity and cluster each into centroids"""
+    samples = {}
+    for filename, record in sorted(records.items()):
+        if record["status"] == "ok":
+            encoding = np.frombuffer(base64.b64decode(record["encoding"]), dtype=np.float32)
+            samples.setdefault(identity_of(filename), []).append(encoding)
+    return FaceGallery.from_samples(samples)
+
+
+def enroll(faces_dir=KNOWN_FACES_DIR, workers=None):
+    """Encode new or changed images across a process pool; returns the records of every image"""
+    previous = load_cache()
+    records = {}
+    pending = {}
+    for filename in list_images(faces_dir):
+        img_path = os.path.join(faces_dir, filename)
+        stat = os.stat(img_path)
+        record = previous.get(filename)
+        # Error records carry no mtime/size, so images whose encoding crashed are always retried
+        if record and record.get("mtime_ns") == stat.st_mtime_ns and record.get("size") == stat.st_size:
+            records[filename] = record
+        else:
+            pending[filename] = (img_path, stat, record)
+
+    print(f"{len(records)} images unchanged, {len(pending)} to check with {workers or os.cpu_count()} workers")
+    if not pending:
+        return records
+
+    # Journal every result as it arrives so an interrupted run resumes where it stopped.
+    # Old records of changed images stay until replaced, keeping their hashes.
+    stale = {filename: record for filename, (_, _, record) in pending.items() if record}
+    write_cache({**stale, **records})
+    last_checkpoint = time.time()
+    new_since_checkpoint = 0
+    with open(CACHE_FILE, "a") as journal, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = {pool.submit(encode_image, img_path, record.get("sha1") if record else None): filename
+                   for filename, (img_path, stat, record) in pending.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            img_path, stat, old_record = pending[filename]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"status": "error", "error": str(e)}
+
+            if result["status"] == "unchanged":
+                record = dict(old_record)
+            else:
+                record = {"file": filename, **result}
+                if result["status"] == "ok":
+                    print(f"Encoded: {filename}")
+                    new_since_checkpoint += 1
+                elif result["status"] == "no_face":
+                    print(f"Warning: No face found in {filename}")
+                elif result["status"] == "error":
+                    # A crashed worker (one segfault breaks the whole pool) says nothing about the image
+                    print(f"Error encoding {filename}: {result['error']}; retrying next run")
+                else:
+                    print(f"Error reading image: {filename}")
+            if record["status"] != "error":
+                record["mtime_ns"] = stat.st_mtime_ns
+                record["size"] = stat.st_size
+            records[filename] = record
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+
+            # Checkpoint so a running server's gallery watcher picks up progress
+            if new_since_checkpoint >= CHECKPOINT_EVERY or \
+                    (new_since_checkpoint and time.time() - last_checkpoint >= CHECKPOINT_INTERVAL):
+                save_gallery(build_gallery({**stale, **records}), GALLERY_FILE)
+                print(f"Checkpoint: {done}/{len(pending)} images processed")
+                new_since_checkpoint = 0
+                last_checkpoint = time.time()
+
+    # Compact the journal down to the images that still exist
+    write_cache(records)
+    return records
+
+
+def write_report(records, elapsed, path=REPORT_FILE):
+    report = {
+        "total": len(records),
+        "encoded": sum(r["status"] == "ok" for r in records.values()),
+        "elapsed_seconds": round(elapsed, 2),
+        "no_face": sorted(f for f, r in records.items() if r["status"] == "no_face"),
+        "failed": {f: r.get("error", r["status"]) for f, r in sorted(records.items())
+                   if r["status"] not in ("ok", "no_face")},
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to {path}: {report['encoded']} encoded, "
+          f"{len(report['no_face'])} without a face, {len(report['failed'])} failed")
+
+
+def build_index(gallery, generation):
+    """Build the ANN index of the gallery saved as generation and report recall/latency against brute force"""
+    if len(gallery) < MIN_INDEX_SIZE:
+        if os.path.exists(INDEX_FILE):
+            os.remove(INDEX_FILE)
+            print(f"Removed {INDEX_FILE}; gallery is small enough for brute force")
+        return
+
+    print("Building ANN index...")
+    encodings = np.asarray(gallery.encodings)
+    index = IVFIndex.build(encodings, generation=generation)
+    index.save(INDEX_FILE)
+    print(f"Index saved to {INDEX_FILE} ({len(index.centroids)} lists, nprobe={index.nprobe})")
+
+    # Perturbed gallery entries stand in for live queries
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(encodings), min(RECALL_QUERIES, len(encodings)), replace=False)
+    queries = encodings[sample] + rng.normal(scale=RECALL_NOISE, size=(len(sample), encodings.shape[1]))
+    for k in (1, 10):
+        print(f"Recall@{k}: {recall_at_k(index, encodings, queries, k):.4f}")
+    start = time.perf_counter()
+    for q in queries:
+        index.search(q, encodings, gallery.sq_norms)
+    print(f"Mean lookup: {(time.perf_counter() - start) / len(queries) * 1000:.3f} ms/face")
+
 
-with open(ENCODINGS_FILE, "wb") as f:
-    pickle.dump({"encodings": known_face_encodings, "names": known_face_names}, f)
+if __name__ == "__main__":
+    print("Processing known faces...")
+    start = time.time()
+    records = enroll()
+    write_report(records, time.time() - start)
 
-print(f"Encodings saved to {ENCODINGS_FILE}")
+    gallery = build_gallery(records)
+    generation = save_gallery(gallery, GALLERY_FILE)
+    print(f"Encodings saved to {GALLERY_FILE}: {len(gallery.identity_names)} identities, "
+          f"{len(gallery.samples)} samples, {len(gallery)} centroids")
+    build_index(gallery, generation)
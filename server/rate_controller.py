@@ -0,0 +1,70 @@
+CONTROL_INTERVAL = 2.0      # seconds between control decisions
+MIN_FPS = 2
+MAX_FPS = 15
+FPS_HEADROOM = 1.1          # ask for slightly more than the processor handled so it never starves
+OVERLOAD_FRACTION = 0.2     # share of frames overwritten unseen that means the camera sends too much
+IDLE_FRACTION = 0.05        # share below which the camera may send more
+RESOLUTIONS = [(320, 240), (480, 360), (640, 480), (800, 600), (1280, 720)]
+MIN_QUALITY = 40
+MAX_QUALITY = 80
+QUALITY_STEP = 10
+SLOW_NETWORK = 0.25         # capture-to-arrival seconds (beyond the fastest frame's) above which JPEG quality is lowered
+FAST_NETWORK = 0.08         # and below which it is raised again
+STABLE_INTERVALS = 3        # calm intervals at MAX_FPS before stepping the resolution up
+
+
+class RateController:
+    """Chooses the frame rate, resolution and JPEG quality a camera should send.
+
+    update() is fed the counters of the last interval and returns the new
+    settings when they changed, else None. The frame rate follows what the
+    processor actually handled when frames are being overwritten, and creeps
+    up one frame per interval while it keeps up. Resolution steps down when
+    even MIN_FPS overloads the processor and back up after a few calm
+    intervals at MAX_FPS. Quality follows the network latency reported by
+    enveloped frames. A resolution bounds the frame rather than setting its
+    shape: cameras fit within it keeping their own aspect ratio
+    (frame_envelope.fit_resolution).
+    """
+
+    def __init__(self, max_resolution=RESOLUTIONS[-1]):
+        self.fps = MAX_FPS
+        self.max_level = 0  # largest resolution the camera can deliver
+        for i, (width, height) in enumerate(RESOLUTIONS):
+            if width <= max_resolution[0] and height <= max_resolution[1]:
+                self.max_level = i
+        self.level = self.max_level
+        self.quality = MAX_QUALITY
+        self._calm = 0
+
+    def settings(self):
+        width, height = RESOLUTIONS[self.level]
+        return {"fps": self.fps, "width": width, "height": height, "quality": self.quality}
+
+    def update(self, received, processed, overwritten, interval, network_latency=None):
+        before = self.settings()
+        overwritten_fraction = overwritten / received if received else 0.0
+
+        if overwritten_fraction > OVERLOAD_FRACTION:
+            self._calm = 0
+            if self.fps > MIN_FPS:
+                self.fps = max(MIN_FPS, min(self.fps - 1, int(processed / interval * FPS_HEADROOM)))
+            elif self.level > 0:
+                self.level -= 1
+        elif overwritten_fraction < IDLE_FRACTION and received:
+            if self.fps < MAX_FPS:
+                self.fps += 1
+            else:
+                self._calm += 1
+                if self._calm >= STABLE_INTERVALS and self.level < self.max_level:
+                    self.level += 1
+                    self._calm = 0
+
+        if network_latency is not None:
+            if network_latency > SLOW_NETWORK:
+                self.quality = max(MIN_QUALITY, self.quality - QUALITY_STEP)
+            elif network_latency < FAST_NETWORK:
+                self.quality = min(MAX_QUALITY, self.quality + QUALITY_STEP)
+
+        after = self.settings()
+        return after if after != before else None
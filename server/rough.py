@@ -1,21 +1,18 @@
 import cv2
 import numpy as np
 import face_recognition
-import pickle
+from face_gallery import load_gallery
+from face_tracker import FaceTracker
 import time
 import queue
 import threading
 
-ENCODINGS_FILE = "face_encodings.pkl"
 PRINT_COOLDOWN = 15 * 60  # 15 minutes
 client_id = "local_test"
 running = True
 
-# Load known encodings
-with open(ENCODINGS_FILE, "rb") as f:
-    data = pickle.load(f)
-    known_face_encodings = np.array(data["encodings"])
-    known_face_names = data["names"]
+# Map known encodings
+gallery = load_gallery()
 
 # Shared state
 print_times_lock = threading.Lock()
@@ -24,8 +21,7 @@ last_print_times = {}
 def process_frames(input_queue, output_queue, client_id):
     global running
     frame_count = 0
-    recognized_names = []
-    prev_num_faces = 0
+    tracker = FaceTracker()
 
     print(f"Processor started for {client_id}")
 
@@ -66,40 +62,27 @@ def process_frames(input_queue, output_queue, client_id):
             except Exception:
                 current_face_locations = []
 
-            num_faces = len(current_face_locations)
-            force_encode = num_faces != prev_num_faces
-            prev_num_faces = num_faces
-
-            if frame_count % 10 == 0 or force_encode:
+            tracks = tracker.update(current_face_locations)
+            to_encode = [t for t in tracks if tracker.needs_encoding(t, current_time)]
+            if to_encode:
                 current_face_encodings = []
                 try:
                     current_face_encodings = face_recognition.face_encodings(
-                        rgb_frame, current_face_locations, model="small"
+                        rgb_frame, [t.box for t in to_encode], model="small"
                     )
                 except Exception:
                     current_face_encodings = []
 
-                current_names = []
-                for encoding in current_face_encodings:
-                    if encoding.size == 0:
-                        current_names.append("Unknown")
-                        continue
-                    try:
-                        dists = np.linalg.norm(known_face_encodings - encoding, axis=1)
-                        matches = dists <= 0.5
-                        if np.any(matches):
-                            first_match_index = np.argmin(dists)
-                            name = known_face_names[first_match_index]
-                        else:
-                            name = "Unknown"
-                    except Exception:
-                        name = "Unknown"
-                    current_names.append(name)
-
-                recognized_names = current_names
+                try:
+                    current_names = gallery.identify(current_face_encodings)
+                except Exception:
+                    current_names = ["Unknown"] * len(current_face_encodings)
+
+                for track, name in zip(to_encode, current_names):
+                    tracker.assign(track, name, current_time)
 
             # Draw results
-            names = recognized_names if len(recognized_names) >= len(current_face_locations) else ["Unknown"]*len(current_face_locations)
+            names = [t.name or "Unknown" for t in tracks]
             for (top, right, bottom, left), name in zip(current_face_locations, names):
                 if name != "Unknown":
                     with print_times_lock:
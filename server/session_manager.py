@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+from client_session import Session
+
+GRACE_PERIOD = 60       # seconds a disconnected session stays warm for its camera to come back
+IDLE_TIMEOUT = 120      # seconds without a frame after which even a connected session is ended
+SETUP_RATE = 10         # new sessions started per second during a reconnect storm
+SETUP_BURST = 20        # new sessions allowed at once before the rate applies
+REAP_INTERVAL = 5       # seconds between reaper passes
+JOIN_TIMEOUT = 2        # seconds to wait for an ended session's processor
+
+
+class SetupLimiter:
+    """Token bucket for the event loop; wait() returns once a token is free.
+
+    Tokens are reserved up front, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate=SETUP_RATE, burst=SETUP_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self.delayed = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            self.delayed += 1
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class SessionManager:
+    """Registry of client sessions that outlive their connections.
+
+    attach() resumes a live session of the same client_id when there is one
+    (a reconnect within GRACE_PERIOD, or a second connection replacing the
+    first), keeping its processor, tracker state and resolved owner. Only
+    a genuinely new session starts a processor, and those starts are rate
+    limited. detach() merely marks a session disconnected; a background
+    reaper ends sessions whose grace period expired or that went idle,
+    joining their processors outside the registry lock.
+    """
+
+    def __init__(self, processor, grace_period=GRACE_PERIOD, idle_timeout=IDLE_TIMEOUT,
+                 setup_rate=SETUP_RATE, setup_burst=SETUP_BURST):
+        self.processor = processor  # processor(session), run on the session's thread
+        self.grace_period = grace_period
+        self.idle_timeout = idle_timeout
+        self.limiter = SetupLimiter(setup_rate, setup_burst)
+        self.stats = {"created": 0, "resumed": 0, "reaped": 0}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, client_id):
+        with self._lock:
+            return self._sessions.get(client_id)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    @staticmethod
+    def _alive(session):
+        # A processor that died on an error leaves a session nothing will serve
+        return session.running and session.thread.is_alive()
+
+    def _resume(self, client_id, source, connection):
+        with self._lock:
+            session = self._sessions.get(client_id)
+            if session is None or not self._alive(session):
+                return None
+            session.source = source
+            session.connection = connection  # a previous connection notices it was replaced
+            session.detached_at = None
+            session.last_active = time.time()
+        self.stats["resumed"] += 1
+        return session
+
+    async def attach(self, client_id, source, connection=None):
+        """Resume or start the session of client_id for connection; returns (session, resumed)"""
+        session = self._resume(client_id, source, connection)
+        if session is not None:
+            return session, True
+
+        await self.limiter.wait()
+        # Another connection of this client may have started it meanwhile
+        session = self._resume(client_id, source, connection)
+        if session is not None:
+            return session, True
+
+        session = Session(client_id, source, connection)
+        session.thread = threading.Thread(target=self.processor, args=(session,), daemon=True)
+        session.thread.start()  # before publishing, so the reaper never sees it not yet alive
+        with self._lock:
+            previous = self._sessions.get(client_id)
+            self._sessions[client_id] = session
+        if previous is not None:
+            previous.stop()  # its processor already ended
+        self.stats["created"] += 1
+        return session, False
+
+    def detach(self, session, connection=None):
+        """Mark session disconnected unless a newer connection has taken it over"""
+        with self._lock:
+            if session.connection is connection and session.detached_at is None:
+                session.connection = None
+                session.detached_at = time.time()
+
+    def end(self, session):
+        """Stop session now instead of keeping it for a reconnect, unless it was already replaced"""
+        with self._lock:
+            if self._sessions.get(session.client_id) is not session:
+                return
+            del self._sessions[session.client_id]
+        session.stop()
+
+    def _expired(self, session, now):
+        if not self._alive(session):
+            return True
+        if session.detached_at is not None and now - session.detached_at > self.grace_period:
+            return True
+        return now - session.last_active > self.idle_timeout
+
+    def reap(self):
+        """End expired sessions; returns how many"""
+        now = time.time()
+        with self._lock:
+            expired = [s for s in self._sessions.values() if self._expired(s, now)]
+            for session in expired:
+                del self._sessions[session.client_id]
+        for session in expired:
+            print(f"Reaping session {session.client_id}")
+            session.stop()
+            session.join(JOIN_TIMEOUT)
+        self.stats["reaped"] += len(expired)
+        return len(expired)
+
+    def start_reaper(self, interval=REAP_INTERVAL):
+        """Start a daemon thread that reaps sessions every interval seconds"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"Session reaper error: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.stop()
+        for session in sessions:
+            session.join(JOIN_TIMEOUT)
@@ -0,0 +1,200 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import threading
+import requests
+import websockets
+from flask import Flask, jsonify, redirect
+from frame_envelope import parse_hello
+
+# Front router for sharded mode: cameras connect here and are proxied to the
+# backend (a main.py process) that owns their client_id; HTTP viewers are
+# redirected to it. shards.json maps shard names to backend URLs:
+#   {"shard-a": {"ws": "ws://10.0.0.2:8888", "http": "http://10.0.0.2:5000"}, ...}
+SHARDS_FILE = os.environ.get("GARUD_SHARDS_FILE", "shards.json")
+ROUTER_WS_PORT = int(os.environ.get("GARUD_WS_PORT", 8888))
+ROUTER_HTTP_PORT = int(os.environ.get("GARUD_HTTP_PORT", 5000))
+VIRTUAL_NODES = 128     # ring points per shard; more points spread cameras more evenly
+WATCH_INTERVAL = 2      # seconds between shards file checks
+STATUS_TIMEOUT = 2      # seconds to wait for a backend's /status
+SHARD_MOVED = 1012      # websocket close code telling a camera to reconnect
+GATEWAY_REFUSED = 1008  # close code for multiplexed gateways, whose cameras span shards
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping client_ids to shard names.
+
+    Each shard owns VIRTUAL_NODES points on the ring and a client_id belongs
+    to the first point clockwise of its hash, so adding or removing a shard
+    only moves the cameras that land on that shard's points.
+    """
+
+    def __init__(self, shards=(), virtual_nodes=VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._points = []  # sorted (hash, shard)
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard):
+        for i in range(self.virtual_nodes):
+            bisect.insort(self._points, (_hash(f"{shard}#{i}"), shard))
+
+    def remove(self, shard):
+        self._points = [p for p in self._points if p[1] != shard]
+
+    def shards(self):
+        return sorted({shard for _, shard in self._points})
+
+    def lookup(self, client_id):
+        if not self._points:
+            raise LookupError("no shards configured")
+        i = bisect.bisect(self._points, (_hash(client_id),))
+        return self._points[i % len(self._points)][1]
+
+
+def load_shards(path=SHARDS_FILE):
+    """Read shards.json; returns ({name: {"ws": url, "http": url}}, HashRing)"""
+    with open(path) as f:
+        shards = json.load(f)
+    return shards, HashRing(shards)
+
+
+routing = ({}, HashRing())  # (shards, ring), swapped as one so HTTP threads never mix generations
+connections = {}  # client_id -> (shard, camera websocket), touched only on the event loop
+app = Flask(__name__)
+
+
+def backend_for(client_id):
+    shards, ring = routing
+    shard = ring.lookup(client_id)
+    return shard, shards[shard]
+
+
+@app.route('/')
+def index():
+    return "Hello from Garud router"
+
+
+@app.route('/shards')
+def shard_list():
+    return jsonify({"shards": routing[0], "cameras": {cid: shard for cid, (shard, _) in list(connections.items())}})
+
+
+@app.route('/shards/<client_id>')
+def shard_of(client_id):
+    shard, backend = backend_for(client_id)
+    return jsonify({"client_id": client_id, "shard": shard, **backend})
+
+
+@app.route('/video_feed/<client_id>')
+def video_feed(client_id):
+    # Viewers talk to the owning backend directly; the router never carries video
+    _, backend = backend_for(client_id)
+    return redirect(f"{backend['http']}/video_feed/{client_id}", code=307)
+
+
+@app.route('/status/<client_id>')
+def client_status(client_id):
+    _, backend = backend_for(client_id)
+    return redirect(f"{backend['http']}/status/{client_id}", code=307)
+
+
+@app.route('/status')
+def server_status():
+    """Every backend's /status, keyed by shard"""
+    status = {}
+    for shard, backend in routing[0].items():
+        try:
+            status[shard] = requests.get(f"{backend['http']}/status", timeout=STATUS_TIMEOUT).json()
+        except Exception as e:
+            status[shard] = {"error": str(e)}
+    return jsonify({"shards": status})
+
+
+async def pump(source, destination):
+    try:
+        async for message in source:
+            await destination.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        pass  # either side closing ends the proxy
+
+
+async def handle_camera(websocket):
+    """Forward a camera's websocket, hello included, to its backend and back"""
+    client_id = None
+    try:
+        hello = await websocket.recv()
+        client_id, options = parse_hello(hello)
+        if options['mux']:
+            # One connection cannot follow its cameras to different shards; gateways look their
+            # cameras up in /shards/<client_id> and open one mux connection per backend instead
+            print(f"Refusing multiplexed gateway {client_id}")
+            await websocket.close(GATEWAY_REFUSED, "connect gateways to their shards directly")
+            return
+        shard, backend = backend_for(client_id)
+        async with websockets.connect(backend['ws'], max_size=None) as upstream:
+            await upstream.send(hello)
+            connections[client_id] = (shard, websocket)
+            print(f"Camera {client_id} -> {shard}")
+            tasks = [asyncio.create_task(pump(websocket, upstream)),
+                     asyncio.create_task(pump(upstream, websocket))]
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    except Exception as e:
+        print(f"Router error for {client_id}: {e}")
+    finally:
+        if client_id and connections.get(client_id, (None, None))[1] is websocket:
+            del connections[client_id]
+        await websocket.close()
+
+
+async def rebalance():
+    """Close the cameras whose shard changed; they reconnect and land on the new owner"""
+    _, ring = routing
+    total = len(connections)
+    moved = [ws for cid, (shard, ws) in connections.items() if ring.lookup(cid) != shard]
+    for websocket in moved:
+        await websocket.close(SHARD_MOVED, "shard moved")
+    print(f"Shards now {ring.shards()}; moved {len(moved)} of {total} cameras")
+
+
+async def watch_shards(path=SHARDS_FILE):
+    global routing
+    last = os.stat(path).st_mtime_ns
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            current = os.stat(path).st_mtime_ns
+            if current == last:
+                continue
+            last = current
+            routing = load_shards(path)
+        except Exception as e:
+            print(f"Shards reload error: {e}")
+            continue
+        await rebalance()
+
+
+async def main():
+    watcher = asyncio.create_task(watch_shards())  # keep a reference so the task is not collected
+    server = await websockets.serve(handle_camera, "0.0.0.0", ROUTER_WS_PORT, max_size=None)
+    print(f"Router started on ws://0.0.0.0:{ROUTER_WS_PORT} for shards {routing[1].shards()}")
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    routing = load_shards()
+    threading.Thread(
+        target=lambda: app.run(host="0.0.0.0", port=ROUTER_HTTP_PORT, threaded=True, debug=False),
+        daemon=True
+    ).start()
+    asyncio.run(main())
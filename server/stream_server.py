@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+from detection_feed import parse_filter, sse_message
+from mosaic import MOSAIC_FPS
+
+REQUEST_TIMEOUT = 10        # seconds to receive a request's headers
+HEADER_LIMIT = 8192         # longest request head accepted
+STREAM_BUFFER = 256 * 1024  # bytes queued for a viewer above which its frames are skipped
+SLOW_CLIENT_TIMEOUT = 10    # seconds a viewer may stay above STREAM_BUFFER before it is dropped
+KEEPALIVE_INTERVAL = 1      # seconds without frames between placeholder frames
+FRAME_TIMEOUT = 10          # seconds without frames after which a stream ends
+EVENT_KEEPALIVE = 15        # seconds without detection events between SSE comments
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class LoopSignal:
+    """Wakes the coroutines watching a hub or subscription, with one thread-safe call per update"""
+
+    def __init__(self, source, loop):
+        self.source = source
+        self.loop = loop
+        self.viewers = 0
+        self._waiting = None
+        source.listeners.append(self._published)
+
+    def _published(self):
+        try:
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # loop already closed at shutdown
+
+    def _wake(self):
+        if self._waiting is not None and not self._waiting.done():
+            self._waiting.set_result(None)
+        self._waiting = None
+
+    async def wait(self, timeout):
+        """Return after the next publish or close, or after timeout seconds"""
+        if self._waiting is None:
+            self._waiting = self.loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._waiting), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def detach(self):
+        self.source.listeners.remove(self._published)
+
+
+async def read_request(reader):
+    """Read a request head; returns (method, path, query dict of lists)"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    method, target, _ = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+    target = urlsplit(target)
+    return method, unquote(target.path), parse_qs(target.query)
+
+
+def part(jpeg, seq=None):
+    header = b"Content-Type: image/jpeg\r\n"
+    if seq is not None:
+        header += b"X-Frame-Seq: %d\r\n" % seq
+    return b"--frame\r\n" + header + b"\r\n" + jpeg + b"\r\n"
+
+
+class StreamServer:
+    """asyncio HTTP server for viewers: /, /status/<client_id>, /video_feed/<client_id>, /mosaic and /events.
+
+    Each viewer is a coroutine on the ingest event loop instead of a thread.
+    Writes never block: a viewer whose socket falls behind has frames
+    skipped until its buffer drains, and one that stays behind for
+    SLOW_CLIENT_TIMEOUT is disconnected.
+    """
+
+    def __init__(self, lookup, status, placeholder, feed=None, mosaics=None):
+        self.lookup = lookup            # client_id -> session or None
+        self.status = status            # session -> status dict
+        self.placeholder = placeholder  # client_id -> keep-alive JPEG
+        self.feed = feed                # DetectionFeed for /events
+        self.mosaics = mosaics          # MosaicManager for /mosaic
+        self.stats = {"viewers": 0, "skipped": 0, "slow_dropped": 0}
+        self._signals = {}  # hub -> LoopSignal, while it has viewers here
+        self._server = None
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self.handle, host, port, limit=HEADER_LIMIT)
+        return self._server
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, query = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT)
+            route, _, client_id = path.strip("/").partition("/")
+            if method != "GET":
+                await self.respond(writer, 405, "Only GET is supported")
+            elif path == "/":
+                await self.respond(writer, 200, "Hello from Garud")
+            elif route == "status" and client_id:
+                session = self.lookup(client_id)
+                if session is not None and session.running:
+                    await self.respond(writer, 200, {"status": "active", "client_id": client_id,
+                                                     **self.status(session)})
+                else:
+                    await self.respond(writer, 404, {"status": "inactive", "client_id": client_id})
+            elif route == "video_feed" and client_id:
+                session = self.lookup(client_id)
+                if session is None:
+                    await self.respond(writer, 404, f"Client {client_id} not found")
+                else:
+                    await self.stream(session, writer)
+            elif path == "/mosaic" and self.mosaics is not None:
+                try:
+                    mosaic = self.mosaics.get(parse_filter(query.get("client_id", [])),
+                                              float(query.get("fps", [MOSAIC_FPS])[0]))
+                except ValueError as e:
+                    await self.respond(writer, 400, str(e))
+                else:
+                    await self.stream(mosaic, writer)
+            elif path == "/events" and self.feed is not None:
+                await self.events(writer, parse_filter(query.get("client_id", [])), parse_filter(query.get("name", [])))
+            else:
+                await self.respond(writer, 404, "Not found")
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass  # stalled, truncated or malformed request
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, body):
+        if isinstance(body, dict):
+            body, content_type = json.dumps(body).encode(), "application/json"
+        else:
+            body, content_type = body.encode(), "text/html; charset=utf-8"
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def stream(self, session, writer):
+        client_id = session.client_id
+        hub = session.hub
+        signal = self._signals.get(hub)
+        if signal is None:
+            signal = self._signals[hub] = LoopSignal(hub, asyncio.get_running_loop())
+        signal.viewers += 1
+        self.stats["viewers"] += 1
+        session.add_viewer()
+        print(f"Starting video feed for {client_id}")
+
+        transport = writer.transport
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        cursor = 0
+        last_frame_time = last_sent = time.time()
+        behind_since = None
+        try:
+            while session.running and not transport.is_closing():
+                now = time.time()
+                if transport.get_write_buffer_size() > STREAM_BUFFER:
+                    # Not keeping up: skip every frame published meanwhile instead of queueing it
+                    self.stats["skipped"] += hub.seq - cursor
+                    cursor = hub.seq
+                    if behind_since is None:
+                        behind_since = now
+                    elif now - behind_since > SLOW_CLIENT_TIMEOUT:
+                        print(f"Dropping slow viewer of {client_id}")
+                        self.stats["slow_dropped"] += 1
+                        break
+                    await signal.wait(KEEPALIVE_INTERVAL)
+                    continue
+                behind_since = None
+
+                frame = hub.read(cursor, timeout=0)
+                if frame is not None:
+                    cursor, jpeg, _ = frame
+                    writer.write(part(jpeg, cursor))
+                    last_frame_time = last_sent = now
+                    continue
+                if hub.closed or now - last_frame_time > FRAME_TIMEOUT:
+                    break
+                if now - last_sent >= KEEPALIVE_INTERVAL:
+                    jpeg = self.placeholder(client_id)
+                    if jpeg:
+                        writer.write(part(jpeg))
+                    last_sent = now
+                await signal.wait(KEEPALIVE_INTERVAL)
+        finally:
+            session.remove_viewer()
+            self.stats["viewers"] -= 1
+            signal.viewers -= 1
+            if signal.viewers == 0:
+                signal.detach()
+                del self._signals[hub]
+            print(f"Video feed ended for {client_id}")
+
+    async def events(self, writer, client_ids, names):
+        """Server-sent detection events, as on Flask's /events"""
+        subscription = self.feed.subscribe(client_ids, names)
+        signal = LoopSignal(subscription, asyncio.get_running_loop())
+        transport = writer.transport
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        last_sent = time.time()
+        try:
+            while not transport.is_closing() and not subscription.closed:
+                if transport.get_write_buffer_size() > STREAM_BUFFER:
+                    print("Dropping slow event subscriber")
+                    self.stats["slow_dropped"] += 1
+                    break
+                event = subscription.get(timeout=0)
+                if event is not None:
+                    writer.write(sse_message(event).encode())
+                    last_sent = time.time()
+                    continue
+                if time.time() - last_sent >= EVENT_KEEPALIVE:
+                    writer.write(b": keep-alive\n\n")
+                    last_sent = time.time()
+                await signal.wait(EVENT_KEEPALIVE)
+        finally:
+            signal.detach()
+            self.feed.unsubscribe(subscription)
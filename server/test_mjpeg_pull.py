@@ -0,0 +1,113 @@
+import asyncio
+import time
+import unittest
+import mjpeg_pull
+from mjpeg_pull import MJPEGPuller
+
+BOUNDARY = "123456789000000000000987654321"  # PART_BOUNDARY of the CameraWebServer firmware
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 20 + b"\xff\xd9"
+
+
+def chunk(data):
+    return b"%x\r\n" % len(data) + data + b"\r\n"
+
+
+class FakeCamera:
+    """Serves /stream the way the firmware's stream_handler does.
+
+    Every part goes out with httpd_resp_send_chunk: the boundary, the part
+    headers with the time since boot in X-Timestamp, then the JPEG split over
+    two chunks. The first connection is dropped after drop_after frames.
+    """
+
+    def __init__(self, chunked=True, drop_after=3):
+        self.chunked = chunked
+        self.drop_after = drop_after
+        self.connections = 0
+        self.boot = time.time() - 1000.0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/stream"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def part(self):
+        uptime = time.time() - self.boot
+        head = (b"\r\n--%s\r\n" % BOUNDARY.encode(),
+                b"Content-Type: image/jpeg\r\nContent-Length: %d\r\nX-Timestamp: %d.%06d\r\n\r\n"
+                % (len(JPEG), int(uptime), int(uptime % 1 * 1e6)))
+        if not self.chunked:
+            return b"".join(head) + JPEG
+        return b"".join(chunk(piece) for piece in (*head, JPEG[:1000], JPEG[1000:]))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        first = self.connections == 1
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace;boundary={BOUNDARY}\r\n"
+                     f"{'Transfer-Encoding: chunked' if self.chunked else 'Connection: close'}\r\n"
+                     f"X-Framerate: 60\r\n\r\n".encode())
+        sent = 0
+        try:
+            while True:
+                writer.write(self.part())
+                await writer.drain()
+                sent += 1
+                if first and sent == self.drop_after:
+                    break  # the camera went away mid-stream
+                await asyncio.sleep(0.01)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class MJPEGPullerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.reconnect_min = mjpeg_pull.RECONNECT_MIN
+        mjpeg_pull.RECONNECT_MIN = 0.05
+
+    def tearDown(self):
+        mjpeg_pull.RECONNECT_MIN = self.reconnect_min
+
+    async def pull(self, camera, frames):
+        url = await camera.start()
+        received = []
+
+        def on_frame(data, captured_at):
+            received.append((data, captured_at, time.time()))
+            if len(received) == frames:
+                puller.stop()
+
+        puller = MJPEGPuller("esp1", url, on_frame)
+        try:
+            await asyncio.wait_for(puller.run(), 10)
+        finally:
+            await camera.stop()
+        return puller, received
+
+    async def test_chunked_stream_survives_dropped_connection(self):
+        camera = FakeCamera(chunked=True, drop_after=3)
+        puller, received = await self.pull(camera, 8)
+        self.assertEqual(camera.connections, 2)
+        self.assertEqual(puller.stats["reconnects"], 1)
+        self.assertEqual(puller.stats["frames"], 8)
+        self.assertTrue(all(data == JPEG for data, _, _ in received))
+        # Camera uptime is mapped onto server time, never later than arrival
+        for _, captured_at, arrived in received:
+            self.assertLessEqual(captured_at, arrived)
+            self.assertGreater(captured_at, arrived - 1.0)
+
+    async def test_plain_stream(self):
+        camera = FakeCamera(chunked=False, drop_after=2)
+        puller, received = await self.pull(camera, 5)
+        self.assertEqual(puller.stats["reconnects"], 1)
+        self.assertEqual([data for data, _, _ in received], [JPEG] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()